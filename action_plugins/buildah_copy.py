@@ -0,0 +1,198 @@
+#!/usr/bin/python -tt
+# -*- coding: utf-8 -*-
+# (c) 2019, Red Hat, Inc
+# Written by Lester Claudio <claudiol at redhat.com>
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Controller side of buildah_copy.  With remote_src=no the src tree lives on
+# the controller: a manifest of it (paths, modes, sizes and sha256) is sent to
+# the buildah_copy module, which compares it with the mounted container and
+# answers with the entries that differ.  Only those are shipped, as a single
+# tar.gz, and unpacked into the container with buildah_add.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import stat
+import tarfile
+import tempfile
+
+from ansible.errors import AnsibleError
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+
+
+def buildah_common_load ( ):
+
+    # custom module_utils are only put on the module side, on the controller
+    # load the file kept next to this plugin's directory
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils', 'buildah_common.py')
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source('buildah_common', path)
+    spec = importlib.util.spec_from_file_location('buildah_common', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+try:
+    from ansible.module_utils import buildah_common
+except ImportError:
+    buildah_common = buildah_common_load()
+
+buildah_exclude_patterns = buildah_common.buildah_exclude_patterns
+buildah_exclude_compile = buildah_common.buildah_exclude_compile
+buildah_source_entries = buildah_common.buildah_source_entries
+buildah_file_digest = buildah_common.buildah_file_digest
+buildah_copy_mode = buildah_common.buildah_copy_mode
+
+
+def buildah_copy_manifest ( src, excludes ):
+
+    # [relpath, kind, mode, size, sha256 or link target] for every entry the
+    # module compares; like buildah copy, a directory's own entry is not copied
+    directory = os.path.isdir(src) and not os.path.islink(src)
+    entries = buildah_source_entries(src, excludes)
+    if directory:
+        next(entries)
+
+    manifest = []
+    for relpath, path in entries:
+        st = os.lstat(path)
+        if stat.S_ISLNK(st.st_mode):
+            manifest.append([relpath, 'link', 0, 0, os.readlink(path)])
+        elif stat.S_ISDIR(st.st_mode):
+            manifest.append([relpath, 'directory', stat.S_IMODE(st.st_mode), 0, None])
+        elif stat.S_ISREG(st.st_mode):
+            manifest.append([relpath, 'file', stat.S_IMODE(st.st_mode), st.st_size, buildah_file_digest(path)])
+
+    return dict(directory=directory, name=os.path.basename(src.rstrip('/')), entries=manifest)
+
+
+def buildah_copy_archive ( src, manifest, needed, arcname, mode ):
+
+    # One compressed stream with the needed entries, owned by root like buildah
+    # copy does without chown; buildah add applies chown when unpacking.
+    fd, path = tempfile.mkstemp(prefix='buildah-copy', suffix='.tar.gz')
+    os.close(fd)
+    try:
+        archive = tarfile.open(path, 'w:gz')
+        try:
+            for relpath in needed:
+                host_path = os.path.join(src, relpath) if relpath else src
+                info = archive.gettarinfo(host_path, arcname=relpath if manifest['directory'] else arcname)
+                info.uid = info.gid = 0
+                info.uname = info.gname = ''
+                if mode is not None and not info.issym():
+                    info.mode = mode
+                if info.isreg():
+                    with open(host_path, 'rb') as f:
+                        archive.addfile(info, f)
+                else:
+                    archive.addfile(info)
+        finally:
+            archive.close()
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = True
+
+    def run(self, tmp=None, task_vars=None):
+
+        if task_vars is None:
+            task_vars = dict()
+
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        args = self._task.args.copy()
+        remote_src = boolean(args.pop('remote_src', True), strict=False)
+
+        if remote_src:
+            result.update(self._execute_module(module_name='buildah_copy', module_args=args, task_vars=task_vars))
+            return result
+
+        if not args.get('src') or not args.get('dest') or args.get('files') or args.get('from') or args.get('copy_from'):
+            result.update(failed=True, msg="remote_src=no needs src and dest, and supports neither files nor from")
+            return result
+
+        try:
+            src = self._find_needle('files', args['src'])
+        except AnsibleError as e:
+            result.update(failed=True, msg=str(e))
+            return result
+
+        try:
+            mode = buildah_copy_mode(args.get('mode'))
+        except ValueError:
+            result.update(failed=True, msg="invalid mode '%s'" % args.get('mode'))
+            return result
+
+        # excluded entries never reach the manifest, nor the target
+        patterns = buildah_exclude_patterns(src, args.pop('exclude', None), boolean(args.pop('ignore_file', False), strict=False))
+        manifest = buildah_copy_manifest(src, buildah_exclude_compile(patterns))
+
+        force = boolean(args.pop('force', False), strict=False)
+        module_args = dict((key, value) for key, value in args.items() if key != 'src')
+        module_args['manifest'] = manifest
+        compared = self._execute_module(module_name='buildah_copy', module_args=module_args, task_vars=task_vars)
+        if compared.get('failed'):
+            result.update(compared)
+            return result
+
+        needed = compared['needed']
+        if force:
+            needed = [entry[0] for entry in manifest['entries']]
+        result.update(changed=bool(needed), needed=needed, transferred_bytes=0)
+        if not needed or self._play_context.check_mode:
+            return result
+
+        archive = buildah_copy_archive(src, manifest, needed, compared['arcname'], mode)
+        added = {}
+        created_tmp = False
+        try:
+            if not self._connection._shell.tmpdir:
+                self._make_tmp_path()
+                created_tmp = True
+            remote_archive = self._connection._shell.join_path(self._connection._shell.tmpdir, 'buildah-copy.tar.gz')
+            self._transfer_file(archive, remote_archive)
+            self._fixup_perms2((self._connection._shell.tmpdir, remote_archive))
+            result['transferred_bytes'] = os.path.getsize(archive)
+
+            add_args = dict(name=args['name'], src=remote_archive, dest=compared['extract_dir'], force=True)
+            for key in ['chown', 'quiet']:
+                if args.get(key):
+                    add_args[key] = args[key]
+            added = self._execute_module(module_name='buildah_add', module_args=add_args, task_vars=task_vars)
+        finally:
+            os.remove(archive)
+            # a tmpdir made by someone else is theirs to remove
+            if created_tmp:
+                self._remove_tmp_path(self._connection._shell.tmpdir)
+
+        for key in ['failed', 'msg', 'rc', 'stdout', 'err']:
+            if key in added:
+                result[key] = added[key]
+        return result
@@ -25,6 +25,14 @@ import os
 import platform
 import tempfile
 import shutil
+import errno
+import hashlib
+import posixpath
+import stat
+import time
+import tarfile
+import subprocess
+import threading
 
 
 
@@ -59,9 +67,43 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Add even when the destination already has the same content
+    buildah_add:
+      name: 32282b25dcb9
+      src: HelloWorld.txt
+      dest: /tmp/HelloWorld.txt
+      force: yes
+    register: result
+
+  - name: BUILDAH | Add a source tree honouring its .containerignore
+    buildah_add:
+      name: 32282b25dcb9
+      src: /srv/build/myapp
+      dest: /opt/myapp
+      ignore_file: yes
+      exclude: [ '.git', '**/*.o' ]
+    register: result
+
+  - name: BUILDAH | Stream a release tarball straight into the container
+    buildah_add:
+      name: 32282b25dcb9
+      src: https://example.com/releases/myapp-1.0.tar.zst
+      dest: /opt/myapp
+      stream: yes
+      checksum: 'sha256:9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+    register: result
+
+  - debug: var=result.entries
+
 
 '''
-def buildah_add ( module, name, chown, quiet, src, dest ):
+
+BUILDAH_STREAM_CHUNK = 1024 * 1024
+
+BUILDAH_STREAM_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def buildah_add ( module, name, chown, quiet, src, dest, ignorefile=None ):
 
     if module.get_bin_path('buildah'):
         buildah_bin = module.get_bin_path('buildah')
@@ -77,6 +119,16 @@ def buildah_add ( module, name, chown, quiet, src, dest ):
         r_cmd = ['--quiet']
         buildah_basecmd.extend(r_cmd)
 
+    if ignorefile:
+        r_cmd = ['--contextdir']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [src]
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = ['--ignorefile']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [ignorefile]
+        buildah_basecmd.extend(r_cmd)
+
     if name:
         r_cmd = [name]
         buildah_basecmd.extend(r_cmd) 
@@ -92,6 +144,264 @@ def buildah_add ( module, name, chown, quiet, src, dest ):
     return module.run_command(buildah_basecmd) 
 
 
+class BuildahStreamReader(object):
+
+    # File object hashing everything read from the source; peeked bytes are
+    # handed out again without being hashed twice.
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.head = b''
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        if self.head:
+            data = self.head if size < 0 else self.head[:size]
+            self.head = self.head[len(data):]
+            return data
+        data = self.fileobj.read() if size < 0 else self.fileobj.read(size)
+        self.digest.update(data)
+        self.size += len(data)
+        return data
+
+    def peek(self, size):
+        data = self.read(size)
+        self.head = data + self.head
+        return data
+
+    def drain(self):
+        while self.read(BUILDAH_STREAM_CHUNK):
+            pass
+
+
+def buildah_stream_open ( module, src ):
+
+    if '://' not in src:
+        return open(src, 'rb')
+    response, info = fetch_url(module, src)
+    if info['status'] != 200:
+        module.fail_json(msg="failed to fetch %s: %s" % (src, info.get('msg')), status=info['status'])
+    return response
+
+
+def buildah_stream_file ( archive, member, path ):
+
+    # a new inode renamed over path, zero blocks of sparse members stay holes
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.buildah-add')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            data = archive.extractfile(member)
+            for chunk in iter(lambda: data.read(BUILDAH_STREAM_CHUNK), b''):
+                if member.issparse() and not chunk.strip(b'\0'):
+                    f.seek(len(chunk), os.SEEK_CUR)
+                else:
+                    f.write(chunk)
+            f.truncate(member.size)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def buildah_stream_member ( root, id_maps, dest, archive, member, owner ):
+
+    # Members are placed below dest, and symlinks in the rootfs are resolved
+    # the way the container sees them, so nothing lands outside of root.
+    name = posixpath.normpath('/' + member.name).lstrip('/')
+    path = posixpath.join(dest, name) if name else dest
+    parent = buildah_rootfs_path(root, posixpath.dirname(path))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    target = os.path.join(parent, posixpath.basename(path)) if name else buildah_rootfs_path(root, dest)
+
+    if member.isdir():
+        if os.path.lexists(target) and (os.path.islink(target) or not os.path.isdir(target)):
+            os.remove(target)
+        if not os.path.isdir(target):
+            os.mkdir(target, 0o700)
+    elif os.path.isdir(target) and not os.path.islink(target):
+        raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+    elif member.isreg():
+        buildah_stream_file(archive, member, target)
+    else:
+        if os.path.lexists(target):
+            os.remove(target)
+        if member.issym():
+            os.symlink(member.linkname, target)
+        elif member.islnk():
+            name = posixpath.normpath('/' + member.linkname).lstrip('/')
+            link = posixpath.join(dest, name)
+            source = os.path.join(buildah_rootfs_path(root, posixpath.dirname(link)), posixpath.basename(link))
+            try:
+                os.link(source, target, follow_symlinks=False)
+            except TypeError:
+                os.link(source, target)
+            # the link shares owner, mode and times with what it links to
+            return target
+        elif member.ischr() or member.isblk():
+            kind = stat.S_IFCHR if member.ischr() else stat.S_IFBLK
+            os.mknod(target, kind | member.mode, os.makedev(member.devmajor, member.devminor))
+        elif member.isfifo():
+            os.mkfifo(target, member.mode)
+        else:
+            raise OSError(errno.EINVAL, "unsupported member type", member.name)
+
+    # the rootfs holds the IDs the host sees through the container's ID maps
+    ids = buildah_host_ids(owner or (member.uid, member.gid), id_maps)
+    if ids is None:
+        raise OSError(errno.EINVAL, "owner %d:%d is not mapped in the container" % (owner or (member.uid, member.gid)), member.name)
+    os.lchown(target, *ids)
+    if not member.issym() and not member.isdir():
+        os.chmod(target, member.mode)
+        os.utime(target, (member.mtime, member.mtime))
+    return target
+
+
+def buildah_stream_merge ( root, staging, dest, root_member ):
+
+    # Move the verified tree from staging into dest.  Entries go as a whole,
+    # except where dest already has a directory: its content is merged and
+    # it only takes the owner, mode and times from the archive.
+    target = buildah_rootfs_path(root, dest)
+    try:
+        os.makedirs(target)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    dirs = [(target, os.lstat(staging))] if root_member else []
+
+    pending = ['']
+    while pending:
+        relpath = pending.pop()
+        staged = os.path.join(staging, relpath) if relpath else staging
+        path = posixpath.join(dest, relpath) if relpath else dest
+        parent = buildah_rootfs_path(root, path)
+        for entry in sorted(os.listdir(staged)):
+            source = os.path.join(staged, entry)
+            target = os.path.join(parent, entry)
+            st = os.lstat(source)
+            existing = os.path.isdir(target) and not os.path.islink(target)
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append((target, st))
+                if existing:
+                    pending.append(os.path.join(relpath, entry) if relpath else entry)
+                    continue
+                if os.path.lexists(target):
+                    os.remove(target)
+            elif existing:
+                raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), posixpath.join(path, entry))
+            os.rename(source, target)
+
+    # directories last, the entries moved into them changed their mtime
+    for target, st in reversed(dirs):
+        os.lchown(target, st.st_uid, st.st_gid)
+        os.chmod(target, stat.S_IMODE(st.st_mode))
+        os.utime(target, (st.st_atime, st.st_mtime))
+
+
+def buildah_stream ( module, name, src, dest, chown, checksum ):
+
+    if not dest.startswith('/'):
+        module.fail_json(msg="stream requires an absolute dest")
+
+    # the stream is only hashed with sha256, any other algorithm is an error
+    algorithm, _, expected = (checksum or '').rpartition(':')
+    if algorithm not in ('', 'sha256'):
+        module.fail_json(msg="unsupported checksum algorithm '%s', only sha256 is supported" % algorithm)
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+    rc, out, err = module.run_command([buildah_bin, 'mount', name])
+    if rc != 0 or not out.strip():
+        module.fail_json(msg="stream needs a mountable container (run as root or in buildah unshare): %s" % err)
+    root = out.strip()
+
+    start = time.time()
+    reader = BuildahStreamReader(buildah_stream_open(module, src))
+    zstd = None
+    feeder = None
+    staging = None
+    entries = 0
+    dirs = []
+    try:
+        owner = buildah_chown_ids(root, chown) if chown else None
+        if chown and owner is None:
+            module.fail_json(msg="cannot resolve chown '%s' in the container" % chown)
+        id_maps = buildah_id_maps(module, buildah_bin, name)
+        if id_maps is None:
+            module.fail_json(msg="cannot read the ID mappings of %s" % name)
+
+        # zstd is not known to tarfile, decompress it in a pipe
+        fileobj = reader
+        if reader.peek(4) == BUILDAH_STREAM_ZSTD_MAGIC:
+            zstd = subprocess.Popen([module.get_bin_path('zstd', required=True), '-dcq'],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+            def feed():
+                try:
+                    for chunk in iter(lambda: reader.read(BUILDAH_STREAM_CHUNK), b''):
+                        zstd.stdin.write(chunk)
+                except (IOError, OSError):
+                    reader.drain()
+                finally:
+                    zstd.stdin.close()
+
+            feeder = threading.Thread(target=feed)
+            feeder.daemon = True
+            feeder.start()
+            fileobj = zstd.stdout
+
+        # Members are unpacked into a staging directory of the rootfs, its own
+        # root for symlinks, and only reach dest once the checksum matched.
+        # 'r|*' never seeks back and members are dropped once placed.
+        staging = tempfile.mkdtemp(dir=root, prefix='.buildah-stream')
+        root_member = False
+        archive = tarfile.open(fileobj=fileobj, mode='r|*')
+        try:
+            while True:
+                member = archive.next()
+                if member is None:
+                    break
+                target = buildah_stream_member(staging, id_maps, '/', archive, member, owner)
+                if member.isdir():
+                    dirs.append((target, member))
+                    root_member = root_member or target == staging
+                entries += 1
+                archive.members = []
+        finally:
+            archive.close()
+
+        # directories last, the files written into them changed their mtime
+        for target, member in reversed(dirs):
+            os.chmod(target, member.mode)
+            os.utime(target, (member.mtime, member.mtime))
+
+        if feeder:
+            feeder.join()
+            zstd.stdout.read()
+            if zstd.wait() != 0:
+                module.fail_json(msg="zstd failed to decompress %s" % src)
+        reader.drain()
+
+        sha256 = reader.digest.hexdigest()
+        if expected and expected.lower() != sha256:
+            module.fail_json(msg="sha256 mismatch for %s: expected %s, got %s, %s is unchanged" % (src, checksum, sha256, dest),
+                             changed=False, entries=entries, bytes=reader.size, sha256=sha256)
+
+        buildah_stream_merge(root, staging, dest, root_member)
+    except (IOError, OSError, EOFError, tarfile.TarError) as e:
+        module.fail_json(msg="failed to stream %s into %s: %s" % (src, dest, e), entries=entries)
+    finally:
+        if zstd and zstd.poll() is None:
+            zstd.kill()
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+        module.run_command([buildah_bin, 'umount', name])
+
+    return dict(changed=True, entries=entries, bytes=reader.size, sha256=sha256,
+                duration=round(time.time() - start, 3))
+
+
 def main():
 
     module = AnsibleModule(
@@ -100,7 +410,14 @@ def main():
             chown=dict(required=False, default=""),
             quiet=dict(required=False, default="no", type="bool"),
             src=dict(required=True),
-            dest=dict(required=True)
+            dest=dict(required=True),
+            force=dict(required=False, default="no", type="bool"),
+            hash_index=dict(required=False, default="~/.cache/buildah-ansible/hash-index.json"),
+            hash_index_size=dict(required=False, default=100000, type="int"),
+            exclude=dict(required=False, type='list'),
+            ignore_file=dict(required=False, default="no", type="bool"),
+            stream=dict(required=False, default="no", type="bool"),
+            checksum=dict(required=False)
         ),
         supports_check_mode = True
     )
@@ -112,8 +429,36 @@ def main():
     quiet = params.get('quiet', '')
     src = params.get('src', '')
     dest = params.get('dest', '')
-    
-    rc, out, err =  buildah_add(module, name, chown, quiet, src, dest)
+    force = params.get('force', '')
+    hash_index = params.get('hash_index', '')
+    hash_index_size = params.get('hash_index_size', '')
+    exclude = params.get('exclude', '')
+    ignore_file = params.get('ignore_file', '')
+    stream = params.get('stream', '')
+    checksum = params.get('checksum', '')
+
+    # unpacked into a staging directory in the mounted rootfs, merged into dest once verified
+    if stream:
+        if module.check_mode:
+            module.exit_json(changed=True)
+        module.exit_json(**buildah_stream(module, name, src, dest, chown, checksum))
+
+    # only a local source directory can be filtered
+    patterns = buildah_exclude_patterns(src, exclude, ignore_file) if os.path.isdir(src) else []
+    excludes = buildah_exclude_compile(patterns)
+
+    # URLs and archives are fetched or unpacked by buildah, compare plain content only
+    local = '://' not in src and not (os.path.isfile(src) and tarfile.is_tarfile(src))
+    uptodate = not force and local and buildah_content_uptodate(module, name, src, dest, chown, hash_index, hash_index_size, excludes=excludes)
+    if uptodate or module.check_mode:
+        module.exit_json(changed=not uptodate, rc=0, stdout='', err='')
+
+    ignorefile = buildah_exclude_file(patterns) if patterns else None
+    try:
+        rc, out, err =  buildah_add(module, name, chown, quiet, src, dest, ignorefile)
+    finally:
+        if ignorefile:
+            os.remove(ignorefile)
 
     if rc == 0:
         module.exit_json(changed=True, rc=rc, stdout=out, err = err )
@@ -123,6 +468,7 @@ def main():
 # import module snippets
 from ansible.module_utils.basic import *
 from ansible.module_utils.urls import *
+from ansible.module_utils.buildah_common import *
 if __name__ == '__main__':
     main()
 
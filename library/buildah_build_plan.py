@@ -0,0 +1,316 @@
+#!/usr/bin/python
+
+#!/usr/bin/python -tt
+# -*- coding: utf-8 -*-
+# (c) 2019, Red Hat, Inc
+# Written by Lester Claudio <claudiol at redhat.com>
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import subprocess
+import tempfile
+import time
+
+
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'community',
+                    'version': '1.0'}
+
+DOCUMENTATION = '''
+---
+module: buildah_build_plan
+version_added: historical
+short_description: Runs an ordered list of buildah steps (from, run, copy, add, config, commit) in a single module invocation.
+description:
+     - Runs an ordered list of buildah steps in a single module invocation.  The buildah binary is
+       resolved once and the working container created by a C(from) step (or passed in with
+       C(container)) is reused by every following step.
+     - Execution stops at the first failing step.  Every executed step is reported with its
+       command, rc, stdout, stderr and duration.
+options:
+  steps:
+    description:
+      - Ordered list of steps.  Each step is a dictionary with exactly one key naming the action
+        (from, run, copy, add, config or commit).
+      - C(from) takes an image name or a dictionary with C(image), C(name) and C(pull).
+      - C(run) takes a string (run through /bin/sh -c), a list (run as is) or a dictionary with
+        C(command), C(args), C(user), C(workingdir) and C(volume).
+      - C(copy) and C(add) take a dictionary with C(src), C(dest) and C(chown).
+      - C(config) takes a dictionary of buildah_config options.  List values repeat the option,
+        dictionary values are passed as KEY=VALUE pairs.
+      - C(commit) takes an image name or a dictionary with C(imgname), C(format), C(rm) and
+        C(squash).
+    required: true
+  container:
+    description:
+      - Existing working container used by the steps until a C(from) step replaces it.
+    required: false
+  metrics_file:
+    description:
+      - Append the wall time, CPU time, peak RSS and block I/O of every step as one JSON
+        document per line to this file.
+    required: false
+
+# informational: requirements for nodes
+requirements: [ buildah ]
+author:
+    - "Red Hat Consulting (NAPS)"
+    - "Lester Claudio"
+'''
+
+EXAMPLES = '''
+  - name: BUILDAH | Build an image with a single "buildah_build_plan" task
+    buildah_build_plan:
+      steps:
+        - from: fedora
+        - run: dnf -y install httpd && dnf clean all
+        - copy:
+            src: /tmp/index.html
+            dest: /var/www/html/index.html
+        - config:
+            port: 80
+            entrypoint: /usr/sbin/httpd -DFOREGROUND
+            label: [ 'maintainer=claudiol', 'version=1.0' ]
+        - commit:
+            imgname: fedora-httpd
+            rm: yes
+    register: result
+
+  - debug: var=result.image_id
+
+  - name: BUILDAH | Record the resources used by every step of a build
+    buildah_build_plan:
+      container: fedora-working-container
+      steps:
+        - run: dnf -y install gcc make
+        - run: make -C /src
+      metrics_file: /var/log/buildah/metrics.jsonl
+    register: result
+
+  - debug: msg="{{ result.steps | map(attribute='metrics') | list }}"
+
+'''
+
+BUILDAH_PLAN_ACTIONS = ['from', 'run', 'copy', 'add', 'config', 'commit']
+
+BUILDAH_CONFIG_FLAGS = dict(
+    annotation='--annotation',
+    arch='--arch',
+    author='--author',
+    cmd='--cmd',
+    comment='--comment',
+    created_by='--created-by',
+    domain='--domainname',
+    entrypoint='--entrypoint',
+    env='--env',
+    healthcheck='--healthcheck',
+    healthcheck_interval='--healthcheck-interval',
+    healthcheck_retries='--healthcheck-retries',
+    healthcheck_start_period='--healthcheck-start-period',
+    healthcheck_timeout='--healthcheck-timeout',
+    history_comment='--history-comment',
+    hostname='--hostname',
+    label='--label',
+    onbuild='--onbuild',
+    os='--os',
+    port='--port',
+    shell='--shell',
+    stop_signal='--stop-signal',
+    user='--user',
+    volume='--volume',
+    workingdir='--workingdir'
+)
+
+
+def buildah_plan_step ( module, step ):
+
+    if not isinstance(step, dict) or len(step) != 1:
+        module.fail_json(msg="each step must be a dictionary with exactly one of: %s" % ', '.join(BUILDAH_PLAN_ACTIONS))
+
+    action = list(step.keys())[0]
+    if action not in BUILDAH_PLAN_ACTIONS:
+        module.fail_json(msg="unsupported step '%s', expected one of: %s" % (action, ', '.join(BUILDAH_PLAN_ACTIONS)))
+
+    spec = step[action]
+    if action in ['copy', 'add', 'config'] and not isinstance(spec, dict):
+        module.fail_json(msg="'%s' step requires a dictionary of options" % action)
+    if action in ['copy', 'add'] and not (spec.get('src') and spec.get('dest')):
+        module.fail_json(msg="'%s' step requires src and dest" % action)
+
+    return action, spec
+
+
+def buildah_plan_cmd ( buildah_bin, action, spec, container ):
+
+    buildah_basecmd = [buildah_bin, action]
+
+    if action == 'from':
+        if not isinstance(spec, dict):
+            spec = dict(image=spec)
+        if spec.get('name'):
+            buildah_basecmd.extend(['--name', spec['name']])
+        if spec.get('pull'):
+            buildah_basecmd.extend(['--pull'])
+        buildah_basecmd.extend([spec['image']])
+
+    elif action == 'run':
+        if isinstance(spec, dict):
+            if spec.get('user'):
+                buildah_basecmd.extend(['--user', spec['user']])
+            if spec.get('workingdir'):
+                buildah_basecmd.extend(['--workingdir', spec['workingdir']])
+            if spec.get('volume'):
+                buildah_basecmd.extend(['--volume', spec['volume']])
+            command = [spec['command']] + list(spec.get('args') or [])
+        elif isinstance(spec, list):
+            command = spec
+        else:
+            command = ['/bin/sh', '-c', spec]
+        buildah_basecmd.extend([container, '--'])
+        buildah_basecmd.extend([str(c) for c in command])
+
+    elif action in ['copy', 'add']:
+        if spec.get('chown'):
+            buildah_basecmd.extend(['--chown', spec['chown']])
+        buildah_basecmd.extend([container, spec['src'], spec['dest']])
+
+    elif action == 'config':
+        for option in sorted(spec.keys()):
+            if option not in BUILDAH_CONFIG_FLAGS:
+                raise ValueError("unsupported config option '%s'" % option)
+            values = spec[option]
+            if isinstance(values, dict):
+                values = ['%s=%s' % (key, values[key]) for key in sorted(values.keys())]
+            elif not isinstance(values, list):
+                values = [values]
+            for value in values:
+                buildah_basecmd.extend([BUILDAH_CONFIG_FLAGS[option], str(value)])
+        buildah_basecmd.extend([container])
+
+    elif action == 'commit':
+        if not isinstance(spec, dict):
+            spec = dict(imgname=spec)
+        if spec.get('format'):
+            buildah_basecmd.extend(['--format', spec['format']])
+        if spec.get('rm'):
+            buildah_basecmd.extend(['--rm'])
+        if spec.get('squash'):
+            buildah_basecmd.extend(['--squash'])
+        buildah_basecmd.extend([container, spec['imgname']])
+
+    return buildah_basecmd
+
+
+def buildah_plan_exec ( argv ):
+
+    # like run_command, but waits with wait4 to get the resources used by the
+    # step; the output goes through temporary files, so no pipe fills up
+    # while the step is waited for
+    start = time.time()
+    stdout = tempfile.TemporaryFile()
+    stderr = tempfile.TemporaryFile()
+    devnull = open(os.devnull, 'rb')
+    try:
+        process = subprocess.Popen(argv, stdin=devnull, stdout=stdout, stderr=stderr, close_fds=True)
+        rc, metrics = buildah_wait(process, start)
+
+        stdout.seek(0)
+        stderr.seek(0)
+        out = stdout.read().decode('utf-8', 'replace')
+        err = stderr.read().decode('utf-8', 'replace')
+    finally:
+        devnull.close()
+        stdout.close()
+        stderr.close()
+
+    return rc, out, err, metrics
+
+
+def buildah_build_plan ( module, steps, container, metrics_file ):
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+
+    results = []
+    image_id = None
+
+    for step in steps:
+        action, spec = buildah_plan_step(module, step)
+
+        if action != 'from' and not container:
+            module.fail_json(msg="'%s' step needs a working container, add a 'from' step or set container" % action,
+                             steps=results)
+
+        try:
+            buildah_basecmd = buildah_plan_cmd(buildah_bin, action, spec, container)
+        except (KeyError, ValueError) as e:
+            module.fail_json(msg="invalid '%s' step: %s" % (action, e), steps=results)
+
+        result = dict(action=action, cmd=buildah_basecmd)
+        results.append(result)
+
+        if module.check_mode:
+            if action == 'from':
+                container = (isinstance(spec, dict) and spec.get('name')) or 'working-container'
+            continue
+
+        rc, out, err, metrics = buildah_plan_exec(buildah_basecmd)
+        result.update(rc=rc, stdout=out, stderr=err, duration=metrics['wall_time'], metrics=metrics)
+        if metrics_file:
+            buildah_metrics_save(metrics_file, [dict(metrics, container=container, action=result['action'], cmd=result['cmd'], rc=result['rc'])])
+
+        if rc != 0:
+            module.fail_json(msg="step %d (%s) failed: %s" % (len(results), action, err),
+                             container=container, image_id=image_id, steps=results)
+
+        if action == 'from':
+            container = out.strip()
+        elif action == 'commit':
+            lines = out.strip().splitlines()
+            image_id = lines[-1].strip() if lines else None
+
+    return container, image_id, results
+
+
+def main():
+
+    module = AnsibleModule(
+        argument_spec = dict(
+            steps=dict(required=True, type='list'),
+            container=dict(required=False),
+            metrics_file=dict(required=False)
+        ),
+        supports_check_mode = True
+    )
+
+    params = module.params
+
+    steps = params.get('steps', [])
+    container = params.get('container', '')
+    metrics_file = params.get('metrics_file', '')
+
+    start = time.time()
+    container, image_id, results = buildah_build_plan(module, steps, container, metrics_file)
+
+    module.exit_json(changed=True, container=container, image_id=image_id, steps=results,
+                     duration=round(time.time() - start, 3))
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.urls import *
+from ansible.module_utils.buildah_common import *
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,9 @@ import os
 import platform
 import tempfile
 import shutil
+import json
+import re
+import shlex
 
 
 
@@ -59,7 +62,44 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Configure the container, only the settings that differ are applied
+    buildah_config:
+      name: fedora-working-container
+      author: claudiol
+      entrypoint: '[ "/usr/sbin/httpd", "-DFOREGROUND" ]'
+      port: 80
+      healthcheck: 'curl -f http://localhost/ || exit 1'
+      healthcheck_interval: 30s
+    register: result
+
+  - debug: var=result.changes
+
+  - name: BUILDAH | Set many environment variables, labels and ports in one "buildah config" call
+    buildah_config:
+      name: fedora-working-container
+      env:
+        LANG: C.UTF-8
+        APP_HOME: /opt/app
+        APP_PORT: 8080
+      label:
+        - maintainer=claudiol
+        - version=1.0
+      port: [ 8080, 8443 ]
+      volume: [ /var/lib/app, /var/log/app ]
+    register: result
+
 '''
+
+BUILDAH_CONFIG_OPTIONS = ['annotation', 'arch', 'author', 'cmd', 'comment', 'created_by', 'domain',
+                          'entrypoint', 'env', 'healthcheck', 'healthcheck_interval',
+                          'healthcheck_retries', 'healthcheck_start_period', 'healthcheck_timeout',
+                          'history_comment', 'hostname', 'label', 'onbuild', 'os', 'port', 'shell',
+                          'stop_signal', 'user', 'volume', 'workingdir']
+
+BUILDAH_CONFIG_LIST_OPTIONS = ['annotation', 'env', 'label', 'port', 'volume']
+
+BUILDAH_DURATION_UNITS = dict(ns=1, us=1000, ms=1000000, s=1000000000, m=60000000000, h=3600000000000)
+
 def buildah_config ( module, name, annotation, arch, author, cmd,
                    comment, created_by, domain, entrypoint,
                    env, healthcheck, healthcheck_interval,
@@ -72,10 +112,10 @@ def buildah_config ( module, name, annotation, arch, author, cmd,
         buildah_bin = module.get_bin_path('buildah')
         buildah_basecmd = [buildah_bin, 'config']
 
-    if annotation:
+    for item in annotation or []:
         r_cmd = ['--annotation']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [annotation]
+        r_cmd = [item]
         buildah_basecmd.extend(r_cmd)
         
     if arch:
@@ -120,10 +160,10 @@ def buildah_config ( module, name, annotation, arch, author, cmd,
         r_cmd = [entrypoint]
         buildah_basecmd.extend(r_cmd)
 
-    if env:
+    for item in env or []:
         r_cmd = ['--env']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [env]
+        r_cmd = [item]
         buildah_basecmd.extend(r_cmd)
 
     if healthcheck:
@@ -168,10 +208,10 @@ def buildah_config ( module, name, annotation, arch, author, cmd,
         r_cmd = [hostname]
         buildah_basecmd.extend(r_cmd)
 
-    if label:
+    for item in label or []:
         r_cmd = ['--label']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [label]
+        r_cmd = [item]
         buildah_basecmd.extend(r_cmd)
 
     ## REVISIT
@@ -187,10 +227,10 @@ def buildah_config ( module, name, annotation, arch, author, cmd,
         r_cmd = [os]
         buildah_basecmd.extend(r_cmd)
 
-    if port:
+    for item in port or []:
         r_cmd = ['--port']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [port]
+        r_cmd = [item]
         buildah_basecmd.extend(r_cmd)
 
     if shell:
@@ -211,10 +251,10 @@ def buildah_config ( module, name, annotation, arch, author, cmd,
         r_cmd = [user]
         buildah_basecmd.extend(r_cmd)
 
-    if volume:
+    for item in volume or []:
         r_cmd = ['--volume']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [volume]
+        r_cmd = [item]
         buildah_basecmd.extend(r_cmd)
 
     if workingdir:
@@ -231,12 +271,127 @@ def buildah_config ( module, name, annotation, arch, author, cmd,
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_config_words ( value ):
+
+    # JSON array form or shell words, as buildah parses --cmd and --shell
+    if value.strip().startswith('['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return shlex.split(value)
+
+
+def buildah_config_duration ( value ):
+
+    value = str(value)
+    if value.isdigit():
+        value = value + 's'
+    parts = re.findall('([0-9.]+)(ns|us|ms|s|m|h)', value)
+    if not parts or ''.join(n + u for n, u in parts) != value:
+        return None
+    return int(sum(float(n) * BUILDAH_DURATION_UNITS[u] for n, u in parts))
+
+
+def buildah_config_is_current ( option, value, info ):
+
+    oci = info.get('OCIv1') or {}
+    oci_config = oci.get('config') or {}
+    docker = info.get('Docker') or {}
+    docker_config = docker.get('config') or {}
+    healthcheck = docker_config.get('Healthcheck') or {}
+
+    if option in ['annotation', 'label']:
+        key, _, val = value.partition('=')
+        current = info.get('ImageAnnotations') if option == 'annotation' else oci_config.get('Labels')
+        return (current or {}).get(key) == val
+    if option == 'env':
+        return value in (oci_config.get('Env') or [])
+    if option == 'port':
+        port = value if '/' in value else value + '/tcp'
+        return port in (oci_config.get('ExposedPorts') or {})
+    if option == 'volume':
+        return value in (oci_config.get('Volumes') or {})
+    if option == 'onbuild':
+        return value in (docker_config.get('OnBuild') or [])
+    if option == 'arch':
+        return oci.get('architecture') == value
+    if option == 'os':
+        return oci.get('os') == value
+    if option == 'author':
+        return oci.get('author') == value
+    if option == 'comment':
+        return docker.get('comment') == value
+    if option == 'created_by':
+        return info.get('ImageCreatedBy') == value
+    if option == 'history_comment':
+        # only newer buildah reports it, otherwise always apply it
+        return info.get('ImageHistoryComment', None) == value
+    if option == 'domain':
+        return docker_config.get('Domainname') == value
+    if option == 'hostname':
+        return docker_config.get('Hostname') == value
+    if option == 'cmd':
+        return oci_config.get('Cmd') == buildah_config_words(value)
+    if option == 'shell':
+        return docker_config.get('Shell') == buildah_config_words(value)
+    if option == 'entrypoint':
+        if value.strip().startswith('['):
+            return oci_config.get('Entrypoint') == buildah_config_words(value)
+        return oci_config.get('Entrypoint') == ['/bin/sh', '-c', value]
+    if option == 'healthcheck':
+        if value == 'NONE':
+            return healthcheck.get('Test') in [None, ['NONE']]
+        if value.strip().startswith('['):
+            return healthcheck.get('Test') == buildah_config_words(value)
+        return healthcheck.get('Test') == ['CMD-SHELL', value]
+    if option == 'healthcheck_retries':
+        return str(healthcheck.get('Retries')) == value
+    if option in ['healthcheck_interval', 'healthcheck_start_period', 'healthcheck_timeout']:
+        key = dict(healthcheck_interval='Interval', healthcheck_start_period='StartPeriod',
+                   healthcheck_timeout='Timeout')[option]
+        return healthcheck.get(key) == buildah_config_duration(value)
+    if option == 'stop_signal':
+        return oci_config.get('StopSignal') == value
+    if option == 'user':
+        return oci_config.get('User') == value
+    if option == 'workingdir':
+        return oci_config.get('WorkingDir') == value
+    return False
+
+
+def buildah_config_items ( value ):
+
+    # "K=V" strings from a string, a list or a dictionary
+    if isinstance(value, dict):
+        return ['%s=%s' % (key, value[key]) for key in sorted(value.keys())]
+    if isinstance(value, list):
+        return [str(item) for item in value]
+    return [str(value)]
+
+
+def buildah_config_changes ( desired, info ):
+
+    changes = {}
+    for option in BUILDAH_CONFIG_OPTIONS:
+        value = desired.get(option)
+        if value is None or value == '':
+            continue
+        if option in BUILDAH_CONFIG_LIST_OPTIONS:
+            items = [item for item in value if not buildah_config_is_current(option, item, info)]
+            if items:
+                changes[option] = items
+        elif not buildah_config_is_current(option, value, info):
+            changes[option] = value
+    return changes
+
+
 def main():
 
     module = AnsibleModule(
         argument_spec = dict(
             name=dict(required=True),
-            annotation=dict(required=False, default=""),
+            annotation=dict(required=False, type="raw"),
             arch=dict(required=False, default=""),
             author=dict(required=False, default=""),
             cmd=dict(required=False, default=""),
@@ -244,22 +399,22 @@ def main():
             created_by=dict(required=False, default=""),
             domain=dict(required=False, default=""),
             entrypoint=dict(required=False, default=""),
-            env=dict(required=False, default=""),
-            healthcheck=dict(required=False, default="NONE"),
-            healthcheck_interval=dict(required=False, type="int"),
+            env=dict(required=False, type="raw"),
+            healthcheck=dict(required=False),
+            healthcheck_interval=dict(required=False),
             healthcheck_retries=dict(required=False, type="int"),
-            healthcheck_start_period=dict(required=False, type="int"),
-            healthcheck_timeout=dict(required=False, type="int"),
+            healthcheck_start_period=dict(required=False),
+            healthcheck_timeout=dict(required=False),
             history_comment=dict(required=False, default=""),
             hostname=dict(required=False, default=""),
-            label=dict(required=False, default=""),
+            label=dict(required=False, type="raw"),
             onbuild=dict(required=False),
             os=dict(required=False),
-            port=dict(required=False),
+            port=dict(required=False, type="raw"),
             shell=dict(required=False),
             stop_signal=dict(required=False),
-            user=dict(rquired=False),
-            volume=dict(required=False),
+            user=dict(required=False),
+            volume=dict(required=False, type="raw"),
             workingdir=dict(required=False)
         ),
         supports_check_mode = True
@@ -268,46 +423,41 @@ def main():
     params = module.params
 
     name = params.get('name', '')
-    annotation = params.get('annotation', '')
-    arch = params.get('arch', '')
-    author = params.get('author', '')
-    cmd = params.get('cmd', '')
-    comment = params.get('comment', '')
-    created_by = params.get('created_by', '')
-    domain = params.get('domain', '')
-    entrypoint = params.get('entrypoint', '')
-    env = params.get('env', '')
-    healthcheck = params.get('env', '')
-    healthcheck_interval=params.get('heathcheck_interval', '')
-    healthcheck_retries=params.get('healthecheck_retries', '')
-    healthcheck_start_period=params.get('healcheck_start_period','')
-    healthcheck_timeout=params.get('healthcheck_timeout','')
-    history_comment=params.get('history_comment', '')
-    hostname=params.get('hostname','')
-    label=params.get('label', '')
-    onbuild=params.get('onbuild','')
-    os=params.get('os', '')
-    port=params.get('port', '')
-    shell=params.get('shell', '')
-    stop_signal=params.get('stop_signal', '')
-    user=params.get('user','')
-    volume=params.get('volume', '')
-    workingdir=params.get('workingdir', '')
-    
-
-    
-    rc, out, err =  buildah_config(module, name, annotation, arch, author, cmd,
-                                   comment, created_by, domain, entrypoint,
-                                   env, healthcheck, healthcheck_interval,
-                                   healthcheck_retries, healthcheck_start_period,
-                                   healthcheck_timeout, history_comment,
-                                   hostname, label, onbuild, os, port, shell,
-                                   stop_signal, user, volume, workingdir)
+
+    desired = {}
+    for option in BUILDAH_CONFIG_OPTIONS:
+        value = params.get(option)
+        if value is None or value == '':
+            continue
+        if option in BUILDAH_CONFIG_LIST_OPTIONS:
+            desired[option] = buildah_config_items(value)
+            continue
+        value = str(value)
+        if option in ['healthcheck_interval', 'healthcheck_start_period', 'healthcheck_timeout'] and value.isdigit():
+            value = value + 's'
+        desired[option] = value
+
+    # inspect once and only send what differs, every "buildah config" call
+    # rewrites the image configuration
+    buildah_bin = module.get_bin_path('buildah', required=True)
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'container', name])
+    if rc != 0:
+        module.fail_json(msg=err)
+    changes = buildah_config_changes(desired, json.loads(out))
+
+    if not changes:
+        module.exit_json(changed=False, rc=0, stdout='', err='', changes=changes)
+
+    if module.check_mode:
+        module.exit_json(changed=True, changes=changes)
+
+    args = dict((option, changes.get(option)) for option in BUILDAH_CONFIG_OPTIONS)
+    rc, out, err =  buildah_config(module, name, **args)
 
     if rc == 0:
-        module.exit_json(changed=True, rc=rc, stdout=out, err = err )
+        module.exit_json(changed=True, rc=rc, stdout=out, err = err, changes=changes )
     else:
-        module.exit_json(changed=False, rc=rc, stdout=out, err = err )
+        module.fail_json(msg = err, rc=rc, stdout=out, changes=changes )
 
 # import module snippets
 from ansible.module_utils.basic import *
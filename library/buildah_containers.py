@@ -25,6 +25,7 @@ import os
 import platform
 import tempfile
 import shutil
+import json as jsonlib
 
 
 
@@ -78,6 +79,15 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Gather facts about the working containers of two base images
+    buildah_containers:
+      facts: yes
+      filter:
+        - ancestor=docker.io/library/fedora:latest
+        - ancestor=registry.access.redhat.com/ubi8/ubi:latest
+
+  - debug: msg="{{ buildah_containers.by_id[buildah_containers.by_name['fedora-working-container']].mountpoint }}"
+
 '''
 def buildah_list_containers ( module, json, truncate, quiet, format, filter, heading ):
 
@@ -103,10 +113,10 @@ def buildah_list_containers ( module, json, truncate, quiet, format, filter, hea
         r_cmd = [format]
         buildah_basecmd.extend(r_cmd)
 
-    if filter != "":
+    for f in filter:
         r_cmd = ['--filter']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [filter]
+        r_cmd = [f]
         buildah_basecmd.extend(r_cmd)
 
     if heading:
@@ -116,6 +126,58 @@ def buildah_list_containers ( module, json, truncate, quiet, format, filter, hea
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_containers_mountpoints ( module, buildah_bin ):
+
+    mountpoints = {}
+    rc, out, err = module.run_command([buildah_bin, 'mount', '--notruncate'])
+    if rc == 0:
+        for line in out.splitlines():
+            fields = line.split()
+            if len(fields) == 2:
+                mountpoints[fields[0]] = fields[1]
+    return mountpoints
+
+
+def buildah_containers_created ( module, buildah_bin ):
+
+    # "buildah containers" has no creation time, containers/storage keeps it
+    # in <graphroot>/<driver>-containers/containers.json
+    created = {}
+    rc, out, err = module.run_command([buildah_bin, 'info'])
+    if rc != 0:
+        return created
+    try:
+        store = jsonlib.loads(out).get('store', {})
+        path = os.path.join(store['GraphRoot'], '%s-containers' % store['GraphDriverName'], 'containers.json')
+        with open(path) as f:
+            for container in jsonlib.load(f) or []:
+                created[container['id']] = container.get('created')
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+    return created
+
+
+def buildah_containers_facts ( module, containers ):
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+    mountpoints = buildah_containers_mountpoints(module, buildah_bin)
+    created = buildah_containers_created(module, buildah_bin)
+
+    by_id = {}
+    by_name = {}
+    for container in containers:
+        container_id = container['id']
+        by_id[container_id] = dict(id=container_id,
+                                   name=container.get('containername'),
+                                   image_id=container.get('imageid'),
+                                   image_name=container.get('imagename'),
+                                   mountpoint=mountpoints.get(container_id, mountpoints.get(container.get('containername'))),
+                                   created=created.get(container_id))
+        by_name[container.get('containername')] = container_id
+
+    return dict(ids=[container['id'] for container in containers], by_id=by_id, by_name=by_name)
+
+
 def main():
 
     module = AnsibleModule(
@@ -124,8 +186,9 @@ def main():
             truncate=dict(required=False, default="yes", type='bool'),
             quiet=dict(required=False, default="no", type='bool'),
             format=dict(required=False, default=""),
-            filter=dict(required=False, default=""),
-            heading=dict(required=False, default="yes")
+            filter=dict(required=False, default=[], type='list'),
+            heading=dict(required=False, default="yes"),
+            facts=dict(required=False, default="no", type='bool')
         ),
         supports_check_mode = True
     )
@@ -138,7 +201,18 @@ def main():
     format = params.get('format', '')
     filter = params.get('filter', '')
     heading = params.get('heading', '')
-    
+    facts = params.get('facts', '')
+
+    if facts:
+        rc, out, err = buildah_list_containers(module, True, False, False, "", filter, False)
+        if rc != 0:
+            module.fail_json(msg=err)
+        try:
+            containers = jsonlib.loads(out.strip() or 'null') or []
+        except ValueError as e:
+            module.fail_json(msg="cannot parse buildah containers output: %s" % e)
+        module.exit_json(changed=False, ansible_facts=dict(buildah_containers=buildah_containers_facts(module, containers)))
+
     rc, out, err =  buildah_list_containers(module, json, truncate, quiet, format, filter, heading)
 
     if rc == 0:
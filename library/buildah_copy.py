@@ -25,6 +25,12 @@ import os
 import platform
 import tempfile
 import shutil
+import errno
+import posixpath
+import stat
+import uuid
+import collections
+from multiprocessing.pool import ThreadPool
 
 
 
@@ -77,9 +83,79 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Copy even when the destination already has the same content
+    buildah_copy:
+      name: c3897c41ac18    # <=== target container
+      src: '/tmp/file.conf' # <=== file that exists on target buildah host
+      dest: '/etc/file.conf'
+      force: yes            # <=== skip the content comparison
+    register: result
+
+  - name: BUILDAH | Compare a large tree using a dedicated source hash index
+    buildah_copy:
+      name: c3897c41ac18
+      src: '/srv/assets/'
+      dest: '/var/www/assets'
+      hash_index: '/var/cache/buildah-ansible/assets-index.json'
+      hash_index_size: 500000
+    register: result
+
+  - name: BUILDAH | Copy many configuration files in one task
+    buildah_copy:
+      name: c3897c41ac18
+      files:
+        - src: /srv/build/httpd.conf
+          dest: /etc/httpd/conf/httpd.conf
+        - src: [ '/srv/build/ssl.conf', '/srv/build/status.conf' ]
+          dest: /etc/httpd/conf.d/
+          mode: '0640'
+        - src: /srv/build/htdocs/
+          dest: /var/www/html
+          chown: 'apache:apache'
+      workers: 8
+    register: result
+
+  - debug: var=result.files
+
+  - name: BUILDAH | Copy a source tree without its VCS data and build output
+    buildah_copy:
+      name: c3897c41ac18
+      src: /srv/build/myapp
+      dest: /opt/myapp
+      ignore_file: yes       # <=== honour /srv/build/myapp/.containerignore
+      exclude:
+        - .git
+        - '**/__pycache__'
+        - build
+        - '!build/release'
+    register: result
+
+  - name: BUILDAH | Copy the build output of a builder container into a slim runtime container
+    buildah_copy:
+      name: runtime-working-container
+      from: builder-working-container   # <=== a container or an image
+      src: /src/myapp/dist/
+      dest: /opt/myapp
+      chown: 'myapp:myapp'
+    register: result
+
+  - name: BUILDAH | Copy a tree from the controller, sending only what changed (needs action_plugins/)
+    buildah_copy:
+      name: c3897c41ac18
+      src: site/               # <=== on the controller
+      dest: /var/www/html
+      remote_src: no
+      ignore_file: yes
+    register: result
+
+  - debug: var=result.transferred_bytes
 
 '''
-def buildah_copy ( module, name, chown, quiet, src, dest ):
+
+BUILDAH_MANIFEST_KINDS = dict(file=stat.S_IFREG, directory=stat.S_IFDIR, link=stat.S_IFLNK)
+
+
+def buildah_copy ( module, name, chown, quiet, src, dest, mode=None, ignorefile=None, copy_from=None ):
 
     if module.get_bin_path('buildah'):
         buildah_bin = module.get_bin_path('buildah')
@@ -90,17 +166,39 @@ def buildah_copy ( module, name, chown, quiet, src, dest ):
         buildah_basecmd.extend(r_cmd)
         r_cmd = [chown]
         buildah_basecmd.extend(r_cmd)
+
+    if mode is not None:
+        r_cmd = ['--chmod']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = ['%o' % mode]
+        buildah_basecmd.extend(r_cmd)
         
     if quiet:
         r_cmd = ['--quiet']
         buildah_basecmd.extend(r_cmd)
 
+    if copy_from:
+        r_cmd = ['--from']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [copy_from]
+        buildah_basecmd.extend(r_cmd)
+
+    if ignorefile:
+        r_cmd = ['--contextdir']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [src]
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = ['--ignorefile']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [ignorefile]
+        buildah_basecmd.extend(r_cmd)
+
     if name:
         r_cmd = [name]
         buildah_basecmd.extend(r_cmd) 
 
     if src:
-        r_cmd = [src]
+        r_cmd = src if isinstance(src, list) else [src]
         buildah_basecmd.extend(r_cmd) 
 
     if dest:
@@ -110,6 +208,316 @@ def buildah_copy ( module, name, chown, quiet, src, dest ):
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_manifest_entry_matches ( entry, dest_path, owner, index, mode=None ):
+
+    # buildah_entry_matches for a source described by a manifest entry of
+    # [relpath, kind, mode, size, sha256 or link target]
+    relpath, kind, entry_mode, size, data = entry
+    try:
+        dest_st = os.lstat(dest_path)
+    except OSError:
+        return False
+
+    if BUILDAH_MANIFEST_KINDS.get(kind) != stat.S_IFMT(dest_st.st_mode):
+        return False
+    if (dest_st.st_uid, dest_st.st_gid) != owner:
+        return False
+    if kind == 'link':
+        return os.readlink(dest_path) == data
+    if (mode if mode is not None else entry_mode) != stat.S_IMODE(dest_st.st_mode):
+        return False
+    if kind == 'file':
+        return size == dest_st.st_size and data == buildah_hash_index_digest(index, dest_path)
+    return True
+
+
+def buildah_manifest_needed ( module, name, manifest, dest, chown, mode, hash_index, hash_index_size ):
+
+    # Where a controller-side tree (see action_plugins/buildah_copy.py) has to
+    # be unpacked and which of its entries the container does not have yet.
+    buildah_bin = module.get_bin_path('buildah', required=True)
+    rc, out, err = module.run_command([buildah_bin, 'mount', name])
+    root = out.strip() if rc == 0 else None
+
+    index = buildah_hash_index_load(hash_index)
+    try:
+        if manifest['directory']:
+            extract_dir, arcname = dest, None
+        else:
+            path = dest
+            if dest.endswith('/') or (root and os.path.isdir(buildah_rootfs_path(root, dest))):
+                path = posixpath.join(dest, manifest['name'])
+            extract_dir, arcname = posixpath.dirname(path) or '.', posixpath.basename(path)
+
+        # relative destinations depend on the container's working directory
+        owner = None
+        if root and dest.startswith('/'):
+            owner = buildah_host_ids(buildah_chown_ids(root, chown), buildah_id_maps(module, buildah_bin, name))
+
+        needed = []
+        for entry in manifest['entries']:
+            if owner is not None:
+                path = posixpath.join(extract_dir, entry[0] if manifest['directory'] else arcname)
+                try:
+                    dest_path = os.path.join(buildah_rootfs_path(root, posixpath.dirname(path)), posixpath.basename(path))
+                    if buildah_manifest_entry_matches(entry, dest_path, owner, index, mode):
+                        continue
+                except (IOError, OSError):
+                    pass
+            needed.append(entry[0])
+    finally:
+        if root:
+            module.run_command([buildah_bin, 'umount', name])
+        buildah_hash_index_save(index, [], hash_index_size)
+
+    return extract_dir, arcname, needed
+
+
+def buildah_copy_entries ( module, files, chown, mode, exclude, ignore_file, source_root=None ):
+
+    entries = []
+    for item in files:
+        if not isinstance(item, dict) or not item.get('src') or not item.get('dest'):
+            module.fail_json(msg="each entry of files needs a src and a dest")
+        try:
+            entry_mode = buildah_copy_mode(item.get('mode', mode))
+        except ValueError:
+            module.fail_json(msg="invalid mode '%s' for %s" % (item.get('mode'), item['dest']))
+        sources = item['src'] if isinstance(item['src'], list) else [item['src']]
+        for source in sources:
+            if source_root:
+                source = buildah_copy_source_path(source_root, source)
+            entries.append(dict(src=source, dest=item['dest'], chown=item.get('chown', chown), mode=entry_mode,
+                                exclude=buildah_exclude_patterns(source, item.get('exclude', exclude), ignore_file)))
+
+    # several sources make their destination a directory, like buildah copy does
+    counts = collections.Counter(entry['dest'] for entry in entries)
+    for entry in entries:
+        if counts[entry['dest']] > 1 and not entry['dest'].endswith('/'):
+            entry['dest'] += '/'
+
+    return entries
+
+
+def buildah_copy_direct_file ( src_path, dest_path, owner, mode ):
+
+    st = os.lstat(src_path)
+    if stat.S_ISDIR(st.st_mode):
+        if os.path.islink(dest_path) or (os.path.lexists(dest_path) and not os.path.isdir(dest_path)):
+            os.remove(dest_path)
+        if not os.path.isdir(dest_path):
+            os.mkdir(dest_path)
+    elif os.path.isdir(dest_path) and not os.path.islink(dest_path):
+        raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), dest_path)
+    elif stat.S_ISLNK(st.st_mode):
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        os.symlink(os.readlink(src_path), dest_path)
+    elif stat.S_ISREG(st.st_mode):
+        # a new inode renamed over dest never writes through links in the rootfs
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest_path), prefix='.buildah-copy')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with open(src_path, 'rb') as source:
+                    shutil.copyfileobj(source, f, 1024 * 1024)
+            os.rename(tmp, dest_path)
+        except (IOError, OSError):
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            raise
+    else:
+        raise OSError(errno.EINVAL, "unsupported file type", src_path)
+
+    os.lchown(dest_path, owner[0], owner[1])
+    if not stat.S_ISLNK(st.st_mode):
+        os.chmod(dest_path, mode if mode is not None else stat.S_IMODE(st.st_mode))
+        os.utime(dest_path, (st.st_atime, st.st_mtime))
+
+
+def buildah_copy_direct ( root, id_maps, entry, excludes ):
+
+    # write into the mounted rootfs with the layout of buildah_content_matches,
+    # False leaves the entry to buildah copy; the owner is stored as the host
+    # sees it through the container's ID maps
+    owner = buildah_host_ids(buildah_chown_ids(root, entry['chown']), id_maps)
+    if owner is None or not entry['dest'].startswith('/'):
+        return False
+
+    try:
+        dest, entries = buildah_copy_layout(root, entry['src'], entry['dest'], excludes)
+        parent = dest if os.path.isdir(entry['src']) and not os.path.islink(entry['src']) else posixpath.dirname(dest)
+        try:
+            os.makedirs(buildah_rootfs_path(root, parent))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        for relpath, src_path in entries:
+            path = posixpath.join(dest, relpath) if relpath else dest
+            parent_path = buildah_rootfs_path(root, posixpath.dirname(path))
+            # the parent can be excluded while a '!' pattern keeps the entry
+            if not os.path.isdir(parent_path):
+                try:
+                    os.makedirs(parent_path)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            buildah_copy_direct_file(src_path, os.path.join(parent_path, posixpath.basename(path)), owner, entry['mode'])
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def buildah_copy_overlaps ( dest, other ):
+
+    # whether two destination trees can touch the same paths; a relative one
+    # depends on the working directory and may land anywhere
+    if not dest.startswith('/') or not other.startswith('/'):
+        return True
+    dest = posixpath.normpath(dest).rstrip('/') + '/'
+    other = posixpath.normpath(other).rstrip('/') + '/'
+    return dest.startswith(other) or other.startswith(dest)
+
+
+def buildah_copy_group_key ( entry ):
+
+    # a directory with exclude patterns is its own context directory
+    filtered = entry['exclude'] and os.path.isdir(entry['src'])
+    return entry['dest'], entry['chown'], entry['mode'], entry['src'] if filtered else None
+
+
+def buildah_copy_group ( module, name, quiet, group, copy_from, entries ):
+
+    if not group:
+        return
+    dest, chown, mode, context = buildah_copy_group_key(group[0])
+    sources = [entry['src'] for entry in group]
+    ignorefile = buildah_exclude_file(group[0]['exclude']) if context else None
+    try:
+        rc, out, err = buildah_copy(module, name, chown, quiet, context or sources, dest, mode, ignorefile, copy_from)
+    finally:
+        if ignorefile:
+            os.remove(ignorefile)
+    if rc != 0:
+        module.fail_json(msg=err, rc=rc, files=entries)
+
+
+def buildah_copy_files ( module, name, entries, quiet, force, hash_index, hash_index_size, workers, copy_from=None ):
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+    rc, out, err = module.run_command([buildah_bin, 'mount', name])
+    root = out.strip() if rc == 0 else None
+    id_maps = buildah_id_maps(module, buildah_bin, name) if root else None
+
+    # compiled once, entries keep the plain patterns for the result
+    for entry in entries:
+        entry['excludes'] = buildah_exclude_compile(entry['exclude'])
+
+    index = buildah_hash_index_load(hash_index)
+    try:
+        for entry in entries:
+            uptodate = False
+            if root and not force and os.path.exists(entry['src']):
+                try:
+                    uptodate = buildah_content_matches(root, id_maps, entry['src'], entry['dest'], entry['chown'], index, entry['mode'], entry['excludes'])
+                except (IOError, OSError, ValueError):
+                    pass
+            entry['changed'] = not uptodate
+
+        # a stale entry is written again, and so is every later entry of the
+        # same tree, or an override later in the list would be undone
+        for position, entry in enumerate(entries):
+            if entry['changed']:
+                for later in entries[position + 1:]:
+                    if buildah_copy_overlaps(entry['dest'], later['dest']):
+                        later['changed'] = True
+        stale = [entry for entry in entries if entry['changed']]
+
+        if module.check_mode or not stale:
+            return entries
+
+        # as root the mounted rootfs is written directly, entries whose tree
+        # no other entry touches in parallel
+        direct = root and os.geteuid() == 0
+        copied = set()
+        if direct:
+            independent = [entry for entry in stale
+                           if not any(other is not entry and buildah_copy_overlaps(entry['dest'], other['dest']) for other in entries)]
+
+            def copy(entry):
+                return buildah_copy_direct(root, id_maps, entry, entry['excludes'])
+
+            if independent:
+                pool = ThreadPool(max(1, min(workers, len(independent))))
+                try:
+                    done = pool.map(copy, independent)
+                finally:
+                    pool.close()
+                    pool.join()
+                copied = set(id(entry) for entry, ok in zip(independent, done) if ok)
+            parallel = set(id(entry) for entry in independent)
+
+        # the rest in list order, one buildah copy for consecutive entries
+        # that go to the same destination
+        group = []
+        for entry in stale:
+            if id(entry) in copied:
+                continue
+            if direct and id(entry) not in parallel:
+                buildah_copy_group(module, name, quiet, group, copy_from, entries)
+                group = []
+                if buildah_copy_direct(root, id_maps, entry, entry['excludes']):
+                    continue
+            if group and buildah_copy_group_key(group[0]) != buildah_copy_group_key(entry):
+                buildah_copy_group(module, name, quiet, group, copy_from, entries)
+                group = []
+            group.append(entry)
+        buildah_copy_group(module, name, quiet, group, copy_from, entries)
+    finally:
+        if root:
+            module.run_command([buildah_bin, 'umount', name])
+        buildah_hash_index_save(index, [entry['src'] for entry in entries], hash_index_size)
+        for entry in entries:
+            del entry['excludes']
+
+    return entries
+
+
+def buildah_copy_source ( module, buildah_bin, copy_from ):
+
+    # A source container is mounted as it is, an image through a temporary
+    # working container.  None leaves the copy to "buildah copy --from", e.g.
+    # when running rootless where the mount is not visible to us.
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'container', copy_from])
+    temporary = rc != 0
+    container = copy_from
+    if temporary:
+        container = 'buildah-copy-%s' % uuid.uuid4().hex[:12]
+        rc, out, err = module.run_command([buildah_bin, 'from', '--name', container, copy_from])
+        if rc != 0:
+            module.fail_json(msg="cannot use '%s' as source: %s" % (copy_from, err))
+
+    rc, out, err = module.run_command([buildah_bin, 'mount', container])
+    if rc == 0 and out.strip():
+        return dict(root=out.strip(), container=container, temporary=temporary)
+
+    if temporary:
+        module.run_command([buildah_bin, 'rm', container])
+    return None
+
+
+def buildah_copy_source_release ( module, buildah_bin, source ):
+
+    module.run_command([buildah_bin, 'umount', source['container']])
+    if source['temporary']:
+        module.run_command([buildah_bin, 'rm', source['container']])
+
+
+def buildah_copy_source_path ( root, src ):
+
+    # src as the source container sees it, relative to its /
+    return buildah_rootfs_path(root, posixpath.join('/', src))
+
+
 def main():
 
     module = AnsibleModule(
@@ -117,9 +525,22 @@ def main():
             name=dict(required=True),
             chown=dict(required=False, default=""),
             quiet=dict(required=False, default="no", type="bool"),
-            src=dict(required=True),
-            dest=dict(required=True)
+            src=dict(required=False),
+            dest=dict(required=False),
+            mode=dict(required=False),
+            files=dict(required=False, type='list'),
+            manifest=dict(required=False, type='dict'),
+            workers=dict(required=False, default=4, type="int"),
+            copy_from=dict(required=False, aliases=['from']),
+            exclude=dict(required=False, type='list'),
+            ignore_file=dict(required=False, default="no", type="bool"),
+            force=dict(required=False, default="no", type="bool"),
+            hash_index=dict(required=False, default="~/.cache/buildah-ansible/hash-index.json"),
+            hash_index_size=dict(required=False, default=100000, type="int")
         ),
+        required_one_of = [['src', 'files', 'manifest']],
+        mutually_exclusive = [['src', 'files', 'manifest'], ['copy_from', 'manifest']],
+        required_together = [['src', 'dest']],
         supports_check_mode = True
     )
 
@@ -130,17 +551,76 @@ def main():
     quiet = params.get('quiet', '')
     src = params.get('src', '')
     dest = params.get('dest', '')
-    
-    rc, out, err =  buildah_copy(module, name, chown, quiet, src, dest)
+    force = params.get('force', '')
+    hash_index = params.get('hash_index', '')
+    hash_index_size = params.get('hash_index_size', '')
+    mode = params.get('mode', '')
+    files = params.get('files', '')
+    manifest = params.get('manifest', '')
+    workers = params.get('workers', '')
+    exclude = params.get('exclude', '')
+    ignore_file = params.get('ignore_file', '')
+    copy_from = params.get('copy_from', '')
 
-    if rc == 0:
-        module.exit_json(changed=True, rc=rc, stdout=out, err = err )
-    else:
-        module.exit_json(changed=False, rc=rc, stdout=out, err = err )
+    # a mounted source is read like any host path, otherwise buildah copy
+    # --from resolves src itself
+    source = None
+    source_root = None
+    if copy_from:
+        buildah_bin = module.get_bin_path('buildah', required=True)
+        source = buildah_copy_source(module, buildah_bin, copy_from)
+        if source:
+            source_root = source['root']
+            copy_from = None
+
+    try:
+        if files:
+            entries = buildah_copy_entries(module, files, chown, mode, exclude, ignore_file, source_root)
+            entries = buildah_copy_files(module, name, entries, quiet, force, hash_index, hash_index_size, workers, copy_from)
+            for entry in entries:
+                entry['mode'] = '%04o' % entry['mode'] if entry['mode'] is not None else None
+            module.exit_json(changed=any(entry['changed'] for entry in entries), files=entries)
+
+        try:
+            mode = buildah_copy_mode(mode)
+        except ValueError:
+            module.fail_json(msg="invalid mode '%s'" % mode)
+
+        if manifest:
+            if not dest:
+                module.fail_json(msg="manifest requires dest")
+            extract_dir, arcname, needed = buildah_manifest_needed(module, name, manifest, dest, chown, mode, hash_index, hash_index_size)
+            module.exit_json(changed=bool(needed), extract_dir=extract_dir, arcname=arcname, needed=needed)
+
+        if source_root:
+            src = buildah_copy_source_path(source_root, src)
+
+        patterns = buildah_exclude_patterns(src, exclude, ignore_file)
+        excludes = buildah_exclude_compile(patterns)
+
+        uptodate = not force and buildah_content_uptodate(module, name, src, dest, chown, hash_index, hash_index_size, mode, excludes)
+        if uptodate or module.check_mode:
+            module.exit_json(changed=not uptodate, rc=0, stdout='', err='')
+
+        ignorefile = buildah_exclude_file(patterns) if patterns and os.path.isdir(src) else None
+        try:
+            rc, out, err =  buildah_copy(module, name, chown, quiet, src, dest, mode, ignorefile, copy_from)
+        finally:
+            if ignorefile:
+                os.remove(ignorefile)
+
+        if rc == 0:
+            module.exit_json(changed=True, rc=rc, stdout=out, err = err )
+        else:
+            module.exit_json(changed=False, rc=rc, stdout=out, err = err )
+    finally:
+        if source:
+            buildah_copy_source_release(module, buildah_bin, source)
 
 # import module snippets
 from ansible.module_utils.basic import *
 from ansible.module_utils.urls import *
+from ansible.module_utils.buildah_common import *
 if __name__ == '__main__':
     main()
 
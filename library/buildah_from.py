@@ -25,6 +25,7 @@ import os
 import platform
 import tempfile
 import shutil
+import json
 
 
 
@@ -57,8 +58,34 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Reuse the "fedora-web" working container, replace it when the fedora image changed
+    buildah_from:
+      name: fedora
+      container_name: fedora-web
+      reuse: yes
+      replace_stale: yes
+    register: result
+
+  - debug: var=result.reused
+
+  - name: BUILDAH | Bind a host managed pip cache into every "buildah run" of the new container
+    buildah_from:
+      name: python:3
+      cache_mounts:
+        - name: pip
+          target: /root/.cache/pip
+          size_limit: 1G
+    register: result
+
+  - debug: var=result.cache_mounts
+
 '''
-def buildah_from ( module, host, authfile, cap_add, cap_drop, cert_dir, cgroup_parent, cidfile, cni_config_dir, cni_plugin_path, cpu_period, cpu_quota, cpu_shares, cpuset_cpus, cpuset_mems, creds, ipc, isolation, memory, memory_swap, name, network, pid, pull, pull_always, quiet, security_options, shm_size, signature_policy, tls_verify, ulimit, userns, userns_uid_map, userns_gid_map, userns_uid_map_user, userns_gid_map_group, uts, volume ):
+
+BUILDAH_FROM_UNRECORDED_VALUES = ['--name', '--cidfile', '--authfile', '--cert_dir', '--creds', '--signature_policy', '--tls_verify']
+
+BUILDAH_FROM_UNRECORDED_FLAGS = ['--pull', '--pull_always', '--quiet']
+
+def buildah_from ( module, host, authfile, cap_add, cap_drop, cert_dir, cgroup_parent, cidfile, cni_config_dir, cni_plugin_path, cpu_period, cpu_quota, cpu_shares, cpuset_cpus, cpuset_mems, creds, ipc, isolation, memory, memory_swap, name, network, pid, pull, pull_always, quiet, security_options, shm_size, signature_policy, tls_verify, ulimit, userns, userns_uid_map, userns_gid_map, userns_uid_map_user, userns_gid_map_group, uts, volume, container_name ):
 
     if module.get_bin_path('buildah'):
         buildah_bin = module.get_bin_path('buildah')
@@ -270,17 +297,84 @@ def buildah_from ( module, host, authfile, cap_add, cap_drop, cert_dir, cgroup_p
         r_cmd = [uts]
         buildah_basecmd.extend(r_cmd)
 
-    if volume:
+    for item in volume or []:
         r_cmd = ['--volume']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [volume]
+        r_cmd = [item]
+        buildah_basecmd.extend(r_cmd)
+
+    if container_name:
+        r_cmd = ['--name']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [container_name]
         buildah_basecmd.extend(r_cmd)
 
     if name:
         r_cmd = [name]
         buildah_basecmd.extend(r_cmd) 
 
-    return module.run_command(buildah_basecmd) 
+    rc, out, err = module.run_command(buildah_basecmd)
+    if rc == 0:
+        buildah_from_record(module, buildah_basecmd, out)
+    return rc, out, err
+
+
+def buildah_from_record ( module, buildah_basecmd, out ):
+
+    # keep the options of the new container for buildah_run's cache, without
+    # the image, the name, the one-off flags and the registry credentials
+    options = []
+    args = buildah_basecmd[2:-1]
+    position = 0
+    while position < len(args):
+        if args[position] in BUILDAH_FROM_UNRECORDED_VALUES:
+            position += 2
+            continue
+        if args[position] not in BUILDAH_FROM_UNRECORDED_FLAGS:
+            options.append(args[position])
+        position += 1
+
+    lines = out.strip().splitlines()
+    if not lines:
+        return
+    rc, out, err = module.run_command([buildah_basecmd[0], 'inspect', '--type', 'container', '--format', '{{.ContainerID}}', lines[-1]])
+    if rc == 0 and out.strip():
+        buildah_container_options_save(out.strip(), options)
+
+
+def buildah_from_reuse ( module, name, container_name, replace_stale ):
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'container', container_name])
+    if rc != 0:
+        return None
+    info = json.loads(out)
+
+    if name == 'scratch':
+        image_id = ''
+    else:
+        rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'image', '--format', '{{.FromImageID}}', name])
+        image_id = out.strip() if rc == 0 else None
+
+    if image_id is not None and info.get('FromImageID', '') == image_id:
+        return info
+
+    # the base image changed or is gone, the container only goes when asked to
+    if image_id is None:
+        msg = "cannot inspect image %s to check container %s: %s" % (name, container_name, err.strip())
+    else:
+        msg = "container %s is based on %s, not on the current %s image %s" % (container_name, info.get('FromImageID', ''), name, image_id)
+    if not replace_stale:
+        module.fail_json(msg=msg + ", set replace_stale to remove it")
+    if module.check_mode:
+        module.exit_json(changed=True, msg=msg, reused=False)
+
+    rc, out, err = module.run_command([buildah_bin, 'rm', container_name])
+    if rc != 0:
+        module.fail_json(msg=err)
+    buildah_container_options_remove(info.get('ContainerID'))
+    return None
 
 
 def main():
@@ -323,7 +417,12 @@ def main():
             userns_uid_map_user=dict(required=False),
             userns_gid_map_group=dict(required=False),
             uts=dict(required=False),
-            volume=dict(required=False)
+            volume=dict(required=False),
+            container_name=dict(required=False),
+            reuse=dict(required=False, default="no", type="bool"),
+            replace_stale=dict(required=False, default="no", type="bool"),
+            cache_mounts=dict(required=False, type='list'),
+            cache_dir=dict(required=False, default="~/.cache/buildah-ansible/mounts")
         ),
         supports_check_mode = True
     )
@@ -367,11 +466,33 @@ def main():
     userns_gid_map_group = params.get('userns_gid_map_group', '')
     uts = params.get('uts', '')
     volume = params.get('volume', '')
-
-    
-    rc, out, err =  buildah_from ( module, host, authfile, cap_add, cap_drop, cert_dir, cgroup_parent, cidfile, cni_config_dir, cni_plugin_path, cpu_period, cpu_quota, cpu_shares, cpuset_cpus, cpuset_mems, creds, ipc, isolation, memory, memory_swap, name, network, pid, pull, pull_always, quiet, security_options, shm_size, signature_policy, tls_verify, ulimit, userns, userns_uid_map, userns_gid_map, userns_uid_map_user, userns_gid_map_group, uts, volume )
+    container_name = params.get('container_name', '')
+    reuse = params.get('reuse', '')
+    replace_stale = params.get('replace_stale', '')
+    cache_mounts = params.get('cache_mounts', '')
+    cache_dir = params.get('cache_dir', '')
+
+    if reuse:
+        if not container_name:
+            module.fail_json(msg="reuse requires container_name")
+        # an existing container keeps the volumes it was created with
+        if cache_mounts:
+            module.fail_json(msg="cache_mounts cannot be used with reuse, pass them to buildah_run instead")
+        info = buildah_from_reuse(module, name, container_name, replace_stale)
+        if info:
+            module.exit_json(changed=False, rc=0, stdout=container_name + '\n', err='',
+                             container_id=info.get('ContainerID'), image_id=info.get('FromImageID'), reused=True)
+        if module.check_mode:
+            module.exit_json(changed=True, reused=False)
+
+    volumes, mounted = buildah_cache_mounts(module, cache_dir, cache_mounts)
+    volume = ([volume] if volume else []) + volumes
+
+    rc, out, err =  buildah_from ( module, host, authfile, cap_add, cap_drop, cert_dir, cgroup_parent, cidfile, cni_config_dir, cni_plugin_path, cpu_period, cpu_quota, cpu_shares, cpuset_cpus, cpuset_mems, creds, ipc, isolation, memory, memory_swap, name, network, pid, pull, pull_always, quiet, security_options, shm_size, signature_policy, tls_verify, ulimit, userns, userns_uid_map, userns_gid_map, userns_uid_map_user, userns_gid_map_group, uts, volume, container_name )
 
     if rc == 0:
+        if cache_mounts:
+            module.exit_json(changed=True, rc=rc, stdout=out, err = err, cache_mounts=mounted )
         module.exit_json(changed=True, rc=rc, stdout=out, err = err )
     else:
         module.fail_json(msg=err) 
@@ -379,6 +500,7 @@ def main():
 # import module snippets
 from ansible.module_utils.basic import *
 from ansible.module_utils.urls import *
+from ansible.module_utils.buildah_common import *
 if __name__ == '__main__':
     main()
 
@@ -25,6 +25,7 @@ import os
 import platform
 import tempfile
 import shutil
+import json as jsonlib
 
 
 
@@ -82,6 +83,23 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Gather indexed facts about the dangling images
+    buildah_images:
+      name:
+      facts: yes
+      dangling: yes
+
+  - debug: var=buildah_images.by_id
+
+  - name: BUILDAH | Look up an image ID by name without re-listing the images
+    buildah_images:
+      name:
+      facts: yes
+      label: [ 'maintainer=claudiol' ]
+      since: docker.io/library/fedora:latest
+
+  - debug: msg="{{ buildah_images.by_name['localhost/myfedoratest:latest'] }}"
+
 '''
 def buildah_list_images ( module, name, json, truncate, digests, format, filter, heading ):
 
@@ -110,6 +128,12 @@ def buildah_list_images ( module, name, json, truncate, digests, format, filter,
     if heading:
         r_cmd = ['--noheading']
         buildah_basecmd.extend(r_cmd)
+
+    for f in filter:
+        r_cmd = ['--filter']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [f]
+        buildah_basecmd.extend(r_cmd)
         
     if name:
         r_cmd = [name]
@@ -119,6 +143,24 @@ def buildah_list_images ( module, name, json, truncate, digests, format, filter,
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_images_facts ( images ):
+
+    # by_name and by_digest point at the full entry in by_id
+    by_id = {}
+    by_name = {}
+    by_digest = {}
+
+    for image in images:
+        by_id[image['id']] = image
+        for image_name in image.get('names') or []:
+            by_name[image_name] = image['id']
+        for digest in image.get('digests') or [image.get('digest')]:
+            if digest:
+                by_digest[digest] = image['id']
+
+    return dict(ids=[image['id'] for image in images], by_id=by_id, by_name=by_name, by_digest=by_digest)
+
+
 def main():
 
     module = AnsibleModule(
@@ -128,8 +170,14 @@ def main():
             truncate=dict(required=False, default="yes", type='bool'),
             digests=dict(required=False, default="no", type='bool'),
             format=dict(required=False, default=""),
-            filter=dict(required=False, default=""),
-            heading=dict(required=False, default="yes")
+            filter=dict(required=False, default=[], type='list'),
+            heading=dict(required=False, default="yes"),
+            facts=dict(required=False, default="no", type='bool'),
+            dangling=dict(required=False, type='bool'),
+            label=dict(required=False, default=[], type='list'),
+            before=dict(required=False),
+            since=dict(required=False),
+            reference=dict(required=False)
         ),
         required_one_of = [['name','str']],
         mutually_exclusive = [['name','str']],
@@ -145,7 +193,35 @@ def main():
     format = params.get('format', '')
     filter = params.get('filter', '')
     heading = params.get('heading', '')
-    
+    facts = params.get('facts', '')
+    dangling = params.get('dangling', None)
+    label = params.get('label', [])
+    before = params.get('before', '')
+    since = params.get('since', '')
+    reference = params.get('reference', '')
+
+    filter = list(filter or [])
+    if dangling is not None:
+        filter.append('dangling=%s' % str(dangling).lower())
+    for l in label or []:
+        filter.append('label=%s' % l)
+    if before:
+        filter.append('before=%s' % before)
+    if since:
+        filter.append('since=%s' % since)
+    if reference:
+        filter.append('reference=%s' % reference)
+
+    if facts:
+        rc, out, err = buildah_list_images(module, id, True, False, False, "", filter, False)
+        if rc != 0:
+            module.fail_json(msg=err)
+        try:
+            images = jsonlib.loads(out.strip() or 'null') or []
+        except ValueError as e:
+            module.fail_json(msg="cannot parse buildah images output: %s" % e)
+        module.exit_json(changed=False, ansible_facts=dict(buildah_images=buildah_images_facts(images)))
+
     rc, out, err =  buildah_list_images(module, id, json, truncate, digests, format, filter, heading)
 
     if rc == 0:
@@ -25,6 +25,10 @@ import os
 import platform
 import tempfile
 import shutil
+import json
+import re
+import time
+from multiprocessing.pool import ThreadPool
 
 
 
@@ -57,6 +61,31 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Inspect an image through the on-host cache and keep only a few fields
+    buildah_inspect:
+      name: docker.io/library/fedora:latest
+      type: image
+      cache: yes
+      fields:
+        - FromImageID
+        - OCIv1.config.Env
+        - OCIv1.config.Labels
+    register: result
+
+  - debug: var=result.inspect
+
+  - name: BUILDAH | Inspect every image on the host in one task
+    buildah_inspect:
+      name: "{{ buildah_images.ids }}"
+      type: image
+      cache: yes
+      fields:
+        - OCIv1.config.Labels
+      workers: 8
+    register: result
+
+  - debug: var=result.errors
+
 '''
 def buildah_inspect ( module, name, format, type ):
 
@@ -83,13 +112,198 @@ def buildah_inspect ( module, name, format, type ):
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_inspect_fields ( data, fields ):
+
+    # keep only the requested keys, nested keys are separated by dots
+    selected = {}
+    for field in fields:
+        value = data
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        selected[field] = value
+    return selected
+
+
+def buildah_inspect_cache_load ( path ):
+
+    cache = dict(path=os.path.expanduser(path), data=dict(images={}), dirty=False)
+    try:
+        with open(cache['path']) as f:
+            cache['data'] = json.load(f)
+    except (IOError, OSError, ValueError):
+        pass
+    return cache
+
+
+def buildah_inspect_cache_save ( cache, size ):
+
+    if not cache['dirty']:
+        return
+
+    images = cache['data']['images']
+    if len(images) > size:
+        keep = sorted(images.items(), key=lambda item: item[1]['used'], reverse=True)[:size]
+        cache['data']['images'] = dict(keep)
+
+    dirname = os.path.dirname(cache['path'])
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.inspect-cache')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache['data'], f)
+        os.rename(tmp, cache['path'])
+    except (IOError, OSError):
+        pass
+
+
+def buildah_inspect_image_dir ( cache, image_id ):
+
+    # where containers/storage keeps the image, recorded from "buildah info"
+    store = cache['data'].get('store')
+    if not store:
+        return None
+    return os.path.join(store['GraphRoot'], '%s-images' % store['GraphDriverName'], image_id)
+
+
+def buildah_inspect_listing ( module, buildah_bin, cache ):
+
+    # map every name and ID to the full image ID in a single call
+    rc, out, err = module.run_command([buildah_bin, 'images', '--json', '--no-trunc'])
+    if rc != 0:
+        return None
+
+    listing = {}
+    for image in json.loads(out.strip() or 'null') or []:
+        image_id = image['id']
+        listing[image_id] = image_id
+        listing['sha256:' + image_id] = image_id
+        for image_name in image.get('names') or []:
+            listing[image_name] = image_id
+
+    # entries of removed images can never be hit again
+    images = cache['data']['images']
+    for image_id in list(images.keys()):
+        if image_id not in listing:
+            del images[image_id]
+            cache['dirty'] = True
+
+    return listing
+
+
+def buildah_inspect_qualified ( name ):
+
+    # a registry and a tag or digest; anything shorter is resolved by buildah
+    # through registries.conf
+    if '/' not in name:
+        return False
+    domain, path = name.split('/', 1)
+    if '.' not in domain and ':' not in domain and domain != 'localhost':
+        return False
+    return '@' in path or ':' in path.rsplit('/', 1)[-1]
+
+
+def buildah_inspect_resolve ( name, listing ):
+
+    if re.match('^(sha256:)?[0-9a-f]{64}$', name) or buildah_inspect_qualified(name):
+        return listing.get(name)
+    if re.match('^[0-9a-f]{3,63}$', name):
+        matches = set(image_id for image_id in listing.values() if image_id.startswith(name))
+        if len(matches) == 1:
+            return matches.pop()
+    return None
+
+
+def buildah_inspect_image_cached ( module, buildah_bin, name, cache, listing ):
+
+    images = cache['data']['images']
+    image_id = name[len('sha256:'):] if name.startswith('sha256:') else name
+
+    # a full image ID that is still in storage needs no buildah call at all
+    image_dir = buildah_inspect_image_dir(cache, image_id)
+    if not (re.match('^[0-9a-f]{64}$', image_id) and image_id in images and image_dir and os.path.isdir(image_dir)):
+        if listing is None:
+            listing = buildah_inspect_listing(module, buildah_bin, cache) or {}
+        image_id = buildah_inspect_resolve(name, listing)
+
+    if image_id and image_id in images:
+        if time.time() - images[image_id]['used'] > 3600:
+            images[image_id]['used'] = time.time()
+            cache['dirty'] = True
+        return 0, images[image_id]['data'], '', True
+
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'image', image_id or name])
+    if rc != 0:
+        return rc, None, err, False
+    data = json.loads(out)
+
+    if 'store' not in cache['data']:
+        rc, info, err = module.run_command([buildah_bin, 'info'])
+        try:
+            store = json.loads(info).get('store', {})
+            if rc == 0 and store.get('GraphRoot') and store.get('GraphDriverName'):
+                cache['data']['store'] = dict(GraphRoot=store['GraphRoot'], GraphDriverName=store['GraphDriverName'])
+        except ValueError:
+            pass
+
+    images[data.get('FromImageID') or image_id] = dict(data=data, used=time.time())
+    cache['dirty'] = True
+    return 0, data, '', False
+
+
+def buildah_inspect_batch ( module, names, format, type, fields, cache, workers ):
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+
+    # one image listing resolves every name of the batch
+    listing = None
+    if cache:
+        listing = buildah_inspect_listing(module, buildah_bin, cache) or {}
+
+    def inspect(name):
+        try:
+            if cache:
+                rc, data, err, hit = buildah_inspect_image_cached(module, buildah_bin, name, cache, listing)
+            else:
+                rc, data, err = buildah_inspect(module, name, format, type)
+                if rc == 0 and not format:
+                    data = json.loads(data)
+        except ValueError as e:
+            return 1, None, str(e)
+        if rc == 0 and fields and not format:
+            data = buildah_inspect_fields(data, fields)
+        return rc, data, err
+
+    pool = ThreadPool(max(1, min(workers, len(names))))
+    try:
+        inspected = pool.map(inspect, names)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = {}
+    errors = {}
+    for name, (rc, data, err) in zip(names, inspected):
+        if rc == 0:
+            results[name] = data
+        else:
+            errors[name] = err
+
+    return results, errors
+
+
 def main():
 
     module = AnsibleModule(
         argument_spec = dict(
-            name=dict(required=True),
+            name=dict(required=True, type='list'),
             format=dict(required=False, default=""),
-            type=dict(required=False, choices=['container', 'image'], default='container')
+            type=dict(required=False, choices=['container', 'image'], default='container'),
+            fields=dict(required=False, default=[], type='list'),
+            cache=dict(required=False, default="no", type="bool"),
+            inspect_cache=dict(required=False, default="~/.cache/buildah-ansible/inspect-cache.json"),
+            inspect_cache_size=dict(required=False, default=1000, type="int"),
+            workers=dict(required=False, default=4, type="int")
         ),
         supports_check_mode = True
     )
@@ -99,13 +313,57 @@ def main():
     name = params.get('name', '')
     format = params.get('format', '')
     type = params.get('type', '')
-    
+    fields = params.get('fields', [])
+    cache = params.get('cache', '')
+    inspect_cache = params.get('inspect_cache', '')
+    inspect_cache_size = params.get('inspect_cache_size', '')
+    workers = params.get('workers', '')
+
+    # images are immutable once committed, containers are not
+    cache = cache and type == 'image' and not format
+
+    if len(name) > 1:
+        if cache:
+            inspect_cache = buildah_inspect_cache_load(inspect_cache)
+        try:
+            results, errors = buildah_inspect_batch(module, name, format, type, fields, inspect_cache if cache else None, workers)
+        finally:
+            if cache:
+                buildah_inspect_cache_save(inspect_cache, inspect_cache_size)
+        module.exit_json(changed=False, results=results, errors=errors)
+
+    name = name[0]
+
+    if cache:
+        buildah_bin = module.get_bin_path('buildah', required=True)
+        inspect_cache = buildah_inspect_cache_load(inspect_cache)
+        try:
+            rc, data, err, hit = buildah_inspect_image_cached(module, buildah_bin, name, inspect_cache, None)
+        finally:
+            buildah_inspect_cache_save(inspect_cache, inspect_cache_size)
+        if rc != 0:
+            module.fail_json(msg=err, results={}, errors={name: err})
+        if fields:
+            data = buildah_inspect_fields(data, fields)
+        module.exit_json(changed=False, rc=rc, stdout=json.dumps(data, indent=4), err='', inspect=data, cache_hit=hit,
+                         results={name: data}, errors={})
+
     rc, out, err =  buildah_inspect(module, name, format, type)
 
+    if rc == 0 and fields and not format:
+        data = buildah_inspect_fields(json.loads(out), fields)
+        module.exit_json(changed=False, rc=rc, stdout=json.dumps(data, indent=4), err=err, inspect=data,
+                         results={name: data}, errors={})
+
+    # results and errors are there whatever the length of name, like a batch
     if rc == 0:
-        module.exit_json(changed=True, rc=rc, stdout=out, err = err )
+        try:
+            data = out if format else json.loads(out)
+        except ValueError:
+            data = out
+        module.exit_json(changed=True, rc=rc, stdout=out, err = err, results={name: data}, errors={})
     else:
-        module.fail_json( msg = err )
+        module.fail_json( msg = err, results={}, errors={name: err} )
 
 # import module snippets
 from ansible.module_utils.basic import *
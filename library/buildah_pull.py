@@ -25,6 +25,9 @@ import os
 import platform
 import tempfile
 import shutil
+import json
+import time
+from multiprocessing.pool import ThreadPool
 
 
 
@@ -43,7 +46,7 @@ description:
 options:
 
 # informational: requirements for nodes
-requirements: [ buildah ]
+requirements: [ buildah, skopeo (for policy newer) ]
 author:
     - "Red Hat Consulting (NAPS)"
     - "Lester Claudio"
@@ -57,6 +60,26 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Pull only when the registry has a different digest than local storage
+    buildah_pull:
+      name: docker.io/library/fedora:latest
+      policy: newer
+    register: result
+
+  - debug: var=result.digest
+
+  - name: BUILDAH | Pre-warm the host with several base images, three at a time
+    buildah_pull:
+      name:
+        - docker.io/library/fedora:latest
+        - registry.access.redhat.com/ubi8/ubi:latest
+        - quay.io/ipbabble/myfedoratest
+      policy: missing
+      workers: 3
+    register: result
+
+  - debug: var=result.images
+
 
 '''
 def buildah_pull ( module, name, authfile, cert_dir, creds, quiet, signature_policy, tls_verify ): 
@@ -104,17 +127,109 @@ def buildah_pull ( module, name, authfile, cert_dir, creds, quiet, signature_pol
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_pull_local ( module, buildah_bin, name, details=False ):
+
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'image', name])
+    if rc != 0:
+        return None
+    info = json.loads(out)
+
+    local = dict(image_id=info.get('FromImageID'), digest=info.get('FromImageDigest'), digests=[], bytes=None)
+    if local['digest']:
+        local['digests'].append(local['digest'])
+
+    if not details:
+        return local
+
+    # newer buildah also records the manifest list digest an image came from
+    rc, out, err = module.run_command([buildah_bin, 'images', '--json', '--no-trunc', name])
+    if rc == 0:
+        try:
+            for image in json.loads(out) or []:
+                if image.get('id') == local['image_id']:
+                    local['digests'].extend(image.get('digests') or [image.get('digest')])
+                    local['bytes'] = image.get('size')
+        except ValueError:
+            pass
+
+    return local
+
+
+def buildah_pull_remote_digest ( module, name, authfile, cert_dir, creds ):
+
+    # (digest, None), or (None, why the registry could not be asked)
+    skopeo_bin = module.get_bin_path('skopeo')
+    if not skopeo_bin:
+        return None, "skopeo is not installed"
+
+    # only registry references have a remote digest to compare with
+    ref = name
+    if '://' not in ref:
+        if ref.split(':')[0] in ['oci', 'oci-archive', 'docker-archive', 'docker-daemon', 'dir', 'containers-storage']:
+            return None, "not a registry reference"
+        ref = 'docker://' + ref
+    elif not ref.startswith('docker://'):
+        return None, "not a registry reference"
+
+    skopeo_cmd = [skopeo_bin, 'inspect']
+    if authfile:
+        skopeo_cmd.extend(['--authfile', authfile])
+    if cert_dir:
+        skopeo_cmd.extend(['--cert-dir', cert_dir])
+    if creds:
+        skopeo_cmd.extend(['--creds', creds])
+    skopeo_cmd.extend([ref])
+
+    rc, out, err = module.run_command(skopeo_cmd)
+    if rc != 0:
+        return None, "skopeo inspect failed: %s" % err.strip()
+    try:
+        digest = json.loads(out).get('Digest')
+    except ValueError:
+        digest = None
+    return digest, None if digest else "skopeo inspect returned no digest"
+
+
+def buildah_pull_image ( module, buildah_bin, name, policy, authfile, cert_dir, creds, quiet, signature_policy, tls_verify ):
+
+    start = time.time()
+    local = buildah_pull_local(module, buildah_bin, name, policy == 'newer')
+    result = dict(changed=False, rc=0, stdout='', err='', pulled=False)
+
+    skip = local and policy == 'missing'
+    if local and policy == 'newer':
+        remote_digest, reason = buildah_pull_remote_digest(module, name, authfile, cert_dir, creds)
+        if reason:
+            module.warn("policy newer cannot compare digests for %s (%s), pulling it" % (name, reason))
+        skip = remote_digest and remote_digest in local['digests']
+
+    if not skip:
+        rc, out, err = buildah_pull ( module, name, authfile, cert_dir, creds, quiet, signature_policy, tls_verify )
+        result.update(rc=rc, stdout=out, err=err, pulled=rc == 0)
+        if rc == 0:
+            pulled = buildah_pull_local(module, buildah_bin, name, True)
+            result['changed'] = not local or not pulled or local['image_id'] != pulled['image_id']
+            local = pulled
+
+    local = local or {}
+    result.update(image_id=local.get('image_id'), digest=local.get('digest'), bytes=local.get('bytes'),
+                  duration=round(time.time() - start, 3))
+    return result
+
+
 def main():
 
     module = AnsibleModule(
         argument_spec = dict(
-            name=dict(required=True),
+            name=dict(required=True, type='list'),
             authfile=dict(required=False),
             cert_dir=dict(required=False),
             creds=dict(required=False),
             quiet=dict(required=False, default="no", type="bool"),
             signature_policy=dict(required=False),
-            tls_verify=dict(required=False, default="no", type="bool")
+            tls_verify=dict(required=False, default="no", type="bool"),
+            policy=dict(required=False, default="always", choices=['always', 'missing', 'newer']),
+            workers=dict(required=False, default=4, type="int")
         ),
         supports_check_mode = True
     )
@@ -128,13 +243,41 @@ def main():
     quiet = params.get('quiet', '')
     signature_policy  = params.get('signature_policy', '')
     tls_verify = params.get('tls_verify', '')
-    
-    rc, out, err =  buildah_pull ( module, name, authfile, cert_dir, creds, quiet, signature_policy, tls_verify )
+    policy = params.get('policy', '')
+    workers = params.get('workers', '')
 
-    if rc == 0:
-        module.exit_json(changed=True, rc=rc, stdout=out, err = err )
+    buildah_bin = module.get_bin_path('buildah', required=True)
+
+    def pull(image):
+        return buildah_pull_image(module, buildah_bin, image, policy, authfile, cert_dir, creds, quiet, signature_policy, tls_verify)
+
+    if len(name) == 1:
+        results = [pull(name[0])]
     else:
-        module.fail_json(msg = err )
+        # a bounded pool keeps the number of concurrent storage writers under control
+        pool = ThreadPool(max(1, min(workers, len(name))))
+        try:
+            results = pool.map(pull, name)
+        finally:
+            pool.close()
+            pool.join()
+
+    images = {}
+    for image, result in zip(name, results):
+        images[image] = dict(changed=result['changed'], pulled=result['pulled'], image_id=result['image_id'],
+                             digest=result['digest'], bytes=result['bytes'], duration=result['duration'],
+                             error=result['err'] if result['rc'] != 0 else None)
+
+    # images is there whatever the length of name, a single image also keeps
+    # the flat result of a plain pull
+    flat = results[0] if len(name) == 1 else {}
+    changed = any(image['changed'] for image in images.values())
+    failed = sorted(image for image in images if images[image]['error'] is not None)
+    if failed:
+        msg = flat['err'] if flat else "failed to pull: %s" % ', '.join(failed)
+        module.fail_json(**dict(flat, msg=msg, changed=changed, images=images))
+
+    module.exit_json(**dict(flat, changed=changed, images=images))
 
 # import module snippets
 from ansible.module_utils.basic import *
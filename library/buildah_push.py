@@ -25,6 +25,8 @@ import os
 import platform
 import tempfile
 import shutil
+import time
+from multiprocessing.pool import ThreadPool
 
 
 
@@ -58,9 +60,21 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Push a release image to several registries at once
+    buildah_push:
+      name: myapp:1.0
+      dest:
+        - docker://quay.io/myorg/myapp:1.0
+        - docker://quay.io/myorg/myapp:latest
+        - docker://registry.example.com/myorg/myapp:1.0
+      workers: 3
+    register: result
+
+  - debug: var=result.destinations
+
 
 '''
-def buildah_push ( module, name, dest, authfile, cert_dir, creds, quiet, signature_policy, tls_verify ): 
+def buildah_push ( module, name, dest, authfile, cert_dir, creds, quiet, signature_policy, tls_verify, digestfile ): 
 
     if module.get_bin_path('buildah'):
         buildah_bin = module.get_bin_path('buildah')
@@ -98,6 +112,12 @@ def buildah_push ( module, name, dest, authfile, cert_dir, creds, quiet, signatu
         r_cmd = ['--quiet']
         buildah_basecmd.extend(r_cmd)
 
+    if digestfile:
+        r_cmd = ['--digestfile']
+        buildah_basecmd.extend(r_cmd)
+        r_cmd = [digestfile]
+        buildah_basecmd.extend(r_cmd)
+
     if name:
         r_cmd = [name]
         buildah_basecmd.extend(r_cmd) 
@@ -109,18 +129,35 @@ def buildah_push ( module, name, dest, authfile, cert_dir, creds, quiet, signatu
     return module.run_command(buildah_basecmd) 
 
 
+def buildah_push_dest ( module, name, dest, authfile, cert_dir, creds, quiet, signature_policy, tls_verify ):
+
+    start = time.time()
+    fd, digestfile = tempfile.mkstemp(prefix='buildah-push-digest')
+    os.close(fd)
+
+    try:
+        rc, out, err = buildah_push ( module, name, dest, authfile, cert_dir, creds, quiet, signature_policy, tls_verify, digestfile )
+        with open(digestfile) as f:
+            digest = f.read().strip() or None
+    finally:
+        os.remove(digestfile)
+
+    return dict(changed=rc == 0, rc=rc, stdout=out, err=err, digest=digest, duration=round(time.time() - start, 3))
+
+
 def main():
 
     module = AnsibleModule(
         argument_spec = dict(
             name=dict(required=True),
-            dest=dict(required=False),
+            dest=dict(required=False, type='list'),
             authfile=dict(required=False),
             cert_dir=dict(required=False),
             creds=dict(required=False),
             quiet=dict(required=False, default="no", type="bool"),
             signature_policy=dict(required=False),
-            tls_verify=dict(required=False, default="no", type="bool")
+            tls_verify=dict(required=False, default="no", type="bool"),
+            workers=dict(required=False, default=4, type="int")
         ),
         supports_check_mode = True
     )
@@ -132,16 +169,42 @@ def main():
     authfile = params.get('authfile', '')
     cert_dir = params.get('cert_dir', '')
     creds = params.get('creds', '')
-    quiet = params.get('creds', '')
+    quiet = params.get('quiet', '')
     signature_policy  = params.get('signature_policy', '')
     tls_verify = params.get('tls_verify', '')
-    
-    rc, out, err =  buildah_push ( module, name, dest, authfile, cert_dir, creds, quiet, signature_policy, tls_verify )
+    workers = params.get('workers', '')
+
+    def push(destination):
+        return buildah_push_dest(module, name, destination, authfile, cert_dir, creds, quiet, signature_policy, tls_verify)
 
-    if rc == 0:
-        module.exit_json(changed=True, rc=rc, stdout=out, err = err )
+    # without dest the image goes to its own name
+    targets = dest or [None]
+    if len(targets) == 1:
+        results = [push(targets[0])]
     else:
-        module.fail_json(msg = err )
+        # every destination re-reads the same local layers, keep the fan-out bounded
+        pool = ThreadPool(max(1, min(workers, len(targets))))
+        try:
+            results = pool.map(push, targets)
+        finally:
+            pool.close()
+            pool.join()
+
+    destinations = {}
+    for destination, result in zip(targets, results):
+        destinations[destination or name] = dict(digest=result['digest'], duration=result['duration'],
+                                                 error=result['err'] if result['rc'] != 0 else None)
+
+    # destinations is there whatever the length of dest, a single destination
+    # also keeps the flat result of a plain push
+    flat = results[0] if len(targets) == 1 else {}
+    changed = any(result['rc'] == 0 for result in results)
+    failed = sorted(d for d in destinations if destinations[d]['error'] is not None)
+    if failed:
+        msg = flat['err'] if flat else "failed to push to: %s" % ', '.join(failed)
+        module.fail_json(**dict(flat, msg=msg, changed=changed, destinations=destinations, failed_destinations=failed))
+
+    module.exit_json(**dict(flat, changed=changed, destinations=destinations))
 
 # import module snippets
 from ansible.module_utils.basic import *
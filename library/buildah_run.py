@@ -25,6 +25,21 @@ import os
 import platform
 import tempfile
 import shutil
+import stat
+import hashlib
+import json
+import posixpath
+import re
+import time
+import uuid
+import collections
+import subprocess
+import sys
+import threading
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
 
 
@@ -63,8 +78,168 @@ EXAMPLES = '''
 
   - debug: var=result.stdout_lines
 
+  - name: BUILDAH | Reuse the cached result of "buildah run" when the image, the container's changes and the command are unchanged
+    buildah_run:
+      name: fedora-working-container
+      command: dnf
+      args: ['-y', 'install', 'httpd']
+      cache: yes
+    register: result
+
+  # the container, made by buildah_from, is recreated from the cached image
+  # with its options and under the same name; other containers run uncached
+  - debug: msg="{{ result.cache_hit }} {{ result.container_id }}"
+
+  - name: BUILDAH | Run several commands in one task, each one reported on its own
+    buildah_run:
+      name: fedora-working-container
+      commands:
+        - dnf -y install httpd
+        - [ 'mkdir', '-p', '/var/www/html' ]
+        - { command: 'chown', args: [ 'apache:apache', '/var/www/html' ] }
+        - dnf clean all
+    register: result
+
+  - debug: var=result.results
+
+  - name: BUILDAH | Run several commands in a single "buildah run" session and keep going on errors
+    buildah_run:
+      name: fedora-working-container
+      commands:
+        - test -f /etc/motd
+        - echo done
+      single_session: yes
+      stop_on_error: no
+    register: result
+
+  - name: BUILDAH | Keep the full output of a noisy step on the host and return only its last 4 KiB
+    buildah_run:
+      name: fedora-working-container
+      command: dnf
+      args: ['-y', 'install', '@development-tools']
+      log_file: /var/log/buildah/dnf-install.log
+      output_head: 0
+      output_tail: 4096
+    register: result
+
+  - debug: var=result.stdout
+
+  # the output fields are named after stdout and stderr for a command and for
+  # every entry of commands alike: stdout, stdout_truncated, stderr_line_count,
+  # stderr_bytes, stderr_sha256, ...
+  - name: BUILDAH | Return only line counts and sha256 of the output
+    buildah_run:
+      name: fedora-working-container
+      command: rpm
+      args: ['-qa']
+      output_summary: yes
+    register: result
+
+  - debug: var=result.stdout_sha256
+
+  - name: BUILDAH | Start a long compile step in the background
+    buildah_run:
+      name: fedora-working-container
+      command: make
+      args: ['-C', '/src', '-j8']
+      background: yes
+    register: job
+
+  - name: BUILDAH | Poll the background step until it is done
+    buildah_run_status:
+      job_id: "{{ job.job_id }}"
+    register: status
+    until: status.state not in ['starting', 'running']
+    retries: 360
+    delay: 10
+
+  - name: BUILDAH | Report the CPU, memory and I/O used by every command and keep a history
+    buildah_run:
+      name: fedora-working-container
+      commands:
+        - dnf -y install gcc make
+        - make -C /src
+      metrics_file: /var/log/buildah/metrics.jsonl
+    register: result
+
+  - debug: msg="{{ result.results | map(attribute='metrics') | list }}"
+
+  - name: BUILDAH | Keep the dnf cache on the host between builds, limited to 2 GiB
+    buildah_run:
+      name: fedora-working-container
+      command: dnf
+      args: ['-y', 'install', 'httpd']
+      cache_mounts:
+        - name: dnf
+          target: /var/cache/dnf
+          size_limit: 2G
+    register: result
+
+  - debug: var=result.cache_mounts
+
+  - name: BUILDAH | Install wheels from the host without copying them into the image
+    buildah_run:
+      name: python-working-container
+      command: pip
+      args: ['install', '--no-index', '--find-links', '/wheels', 'myapp']
+      mounts:
+        - /srv/build/wheels:/wheels
+        - src: /srv/build/src
+          target: /src
+          options: z
+    register: result
+
 '''
-def buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir, cni_plugin_path, hostname, ipc, isolation, network, pivot, pid, runtime, runtime_flag, security_options, user, uts, volume ):
+
+BUILDAH_RUN_JOB_RUNNER = '''
+import json, os, subprocess, sys, time
+
+job = sys.argv[1]
+
+def save(status):
+    tmp = os.path.join(job, '.status.json')
+    with open(tmp, 'w') as f:
+        json.dump(status, f)
+    os.rename(tmp, os.path.join(job, 'status.json'))
+
+with open(os.path.join(job, 'job.json')) as f:
+    spec = json.load(f)
+
+status = dict(state='running', pid=os.getpid(), started=time.time(), current=None, rc=None, results=[])
+save(status)
+
+devnull = open(os.devnull, 'rb')
+with open(os.path.join(job, 'output.log'), 'ab') as log:
+    for index, command in enumerate(spec['commands']):
+        status['current'] = index
+        save(status)
+        start = time.time()
+        metrics = None
+        try:
+            process = subprocess.Popen(command['argv'], stdin=devnull, stdout=log, stderr=subprocess.STDOUT, close_fds=True)
+            pid, rc, usage = os.wait4(process.pid, 0)
+            rc = -os.WTERMSIG(rc) if os.WIFSIGNALED(rc) else os.WEXITSTATUS(rc)
+            process.returncode = rc
+            metrics = dict(wall_time=round(time.time() - start, 3), user_time=round(usage.ru_utime, 3),
+                           system_time=round(usage.ru_stime, 3), max_rss=usage.ru_maxrss * 1024,
+                           read_bytes=usage.ru_inblock * 512, write_bytes=usage.ru_oublock * 512)
+        except OSError as e:
+            log.write(('%s\\n' % e).encode('utf-8'))
+            rc = 127
+        log.flush()
+        status['results'].append(dict(command=command['command'], rc=rc, duration=round(time.time() - start, 3), metrics=metrics))
+        if rc != 0 and status['rc'] is None:
+            status['rc'] = rc
+        if rc != 0 and spec['stop_on_error']:
+            break
+
+status.update(state='finished' if not status['rc'] else 'failed', rc=status['rc'] or 0, current=None,
+              finished=time.time(), duration=round(time.time() - status['started'], 3))
+save(status)
+'''
+
+
+def buildah_run_basecmd ( module, name, cap_add, cap_drop, cni_config_dir, cni_plugin_path, hostname, ipc, isolation, network, pivot, pid, runtime, runtime_flag, security_options, user, uts, volume ):
 
     if module.get_bin_path('buildah'):
         buildah_bin = module.get_bin_path('buildah')
@@ -72,26 +247,26 @@ def buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir
 
     ## REVISIT - Multiple Entries
     if cap_add:
-        r_cmd = ['--cap_add']
+        r_cmd = ['--cap-add']
         buildah_basecmd.extend(r_cmd)
         r_cmd = [cap_add]
         buildah_basecmd.extend(r_cmd)
 
     ## REVISIT - Multiple Entries
     if cap_drop:
-        r_cmd = ['--cap_drop']
+        r_cmd = ['--cap-drop']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [host]
+        r_cmd = [cap_drop]
         buildah_basecmd.extend(r_cmd)
 
     if cni_config_dir:
-        r_cmd = ['--cni_config_dir']
+        r_cmd = ['--cni-config-dir']
         buildah_basecmd.extend(r_cmd)
         r_cmd = [cni_config_dir]
         buildah_basecmd.extend(r_cmd)
 
     if cni_plugin_path:
-        r_cmd = ['--cni_plugin_path']
+        r_cmd = ['--cni-plugin-path']
         buildah_basecmd.extend(r_cmd)
         r_cmd = [cni_plugin_path]
         buildah_basecmd.extend(r_cmd)
@@ -134,17 +309,17 @@ def buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir
     if runtime:
         r_cmd = ['--runtime']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [runtime_flag]
+        r_cmd = [runtime]
         buildah_basecmd.extend(r_cmd)
 
     if runtime_flag:
-        r_cmd = ['--runtime_flag']
+        r_cmd = ['--runtime-flag']
         buildah_basecmd.extend(r_cmd)
         r_cmd = [runtime_flag]
         buildah_basecmd.extend(r_cmd)
 
     if security_options:
-        r_cmd = ['--security_opt']
+        r_cmd = ['--security-opt']
         buildah_basecmd.extend(r_cmd)
         r_cmd = [security_options]
         buildah_basecmd.extend(r_cmd)
@@ -161,10 +336,10 @@ def buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir
         r_cmd = [uts]
         buildah_basecmd.extend(r_cmd)
 
-    if volume:
+    for item in volume or []:
         r_cmd = ['--volume']
         buildah_basecmd.extend(r_cmd)
-        r_cmd = [volume]
+        r_cmd = [item]
         buildah_basecmd.extend(r_cmd)
 
 
@@ -172,8 +347,15 @@ def buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir
         r_cmd = [name]
         buildah_basecmd.extend(r_cmd)
 
+    return buildah_basecmd
+
+
+def buildah_run ( module, buildah_basecmd, command, args, capture ):
+
+    buildah_basecmd = list(buildah_basecmd)
+
     if command:
-        r_cmd = [command]
+        r_cmd = ['--', command]
         buildah_basecmd.extend(r_cmd)
 
     if args:
@@ -186,7 +368,472 @@ def buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir
                 buildah_basecmd.extend(r_cmd)
 
 
-    return module.run_command(buildah_basecmd) 
+    return buildah_run_exec(module, buildah_basecmd, capture)
+
+
+def buildah_run_argv ( command ):
+
+    # a string is run by the shell, a list as is, a dictionary is command plus args
+    if isinstance(command, dict):
+        return [str(command['command'])] + [str(arg) for arg in command.get('args') or []]
+    if isinstance(command, list):
+        return [str(arg) for arg in command]
+    return ['/bin/sh', '-c', str(command)]
+
+
+def buildah_run_output_new ( ):
+
+    return dict(head=[], head_size=0, tail=collections.deque(), tail_size=0,
+                bytes=0, lines=0, last=b'', sha256=hashlib.sha256())
+
+
+def buildah_run_output_feed ( output, data, capture ):
+
+    if not data:
+        return
+
+    output['bytes'] += len(data)
+    output['lines'] += data.count(b'\n')
+    output['last'] = data[-1:]
+    output['sha256'].update(data)
+
+    if capture['summary']:
+        return
+    if capture['head'] is None and capture['tail'] is None:
+        output['head'].append(data)
+        return
+
+    # keep the first output_head and the last output_tail bytes only
+    room = (capture['head'] or 0) - output['head_size']
+    if room > 0:
+        output['head'].append(data[:room])
+        output['head_size'] += len(data[:room])
+        data = data[room:]
+    if capture['tail'] and data:
+        output['tail'].append(data)
+        output['tail_size'] += len(data)
+        while output['tail_size'] - len(output['tail'][0]) >= capture['tail']:
+            output['tail_size'] -= len(output['tail'].popleft())
+
+
+def buildah_run_output_fields ( output, name, capture ):
+
+    if capture['summary']:
+        lines = output['lines'] + (1 if output['last'] not in [b'', b'\n'] else 0)
+        return {name + '_line_count': lines, name + '_bytes': output['bytes'],
+                name + '_sha256': output['sha256'].hexdigest()}
+
+    head = b''.join(output['head'])
+    tail = b''.join(output['tail'])
+    if capture['tail']:
+        tail = tail[-capture['tail']:]
+    omitted = output['bytes'] - len(head) - len(tail)
+    if omitted > 0:
+        head += ('\n[... %d bytes omitted ...]\n' % omitted).encode('utf-8')
+
+    fields = {name: (head + tail).decode('utf-8', 'replace')}
+    if capture['head'] is not None or capture['tail'] is not None:
+        fields[name + '_truncated'] = omitted > 0
+    return fields
+
+
+def buildah_run_stream ( argv, capture, marker=None ):
+
+    # stdout and stderr are read in chunks by one thread each, written to the
+    # log file as they arrive and only kept up to the configured head and tail.
+    # With a marker, lines consisting of the marker and an rc close the
+    # current segment of the output and start the next one.
+    marker_line = re.compile(b'^' + re.escape(marker.encode('utf-8')) + b' (\\d+)$') if marker else None
+
+    start = time.time()
+    devnull = open(os.devnull, 'rb')
+    try:
+        process = subprocess.Popen(argv, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
+    finally:
+        devnull.close()
+
+    def emit(segments, data):
+        buildah_run_output_feed(segments[-1], data, capture)
+        if capture['log']:
+            with capture['lock']:
+                capture['log'].write(data)
+
+    def read(pipe, segments):
+        pending = b''
+        newline = False
+        while True:
+            data = os.read(pipe.fileno(), 65536)
+            if not data:
+                break
+            if not marker_line:
+                emit(segments, data)
+                continue
+
+            # hold back the newline ending each line, the marker is printed
+            # on a line of its own and takes the newline before it with it
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                match = marker_line.match(line)
+                if match:
+                    segments[-1]['rc'] = int(match.group(1))
+                    segments.append(buildah_run_output_new())
+                    newline = False
+                    continue
+                emit(segments, b'\n' + line if newline else line)
+                newline = True
+            if len(pending) > len(marker) + 16:
+                emit(segments, b'\n' + pending if newline else pending)
+                pending = b''
+                newline = False
+
+        if newline:
+            pending = b'\n' + pending
+        emit(segments, pending)
+        pipe.close()
+
+    stdout = [buildah_run_output_new()]
+    stderr = [buildah_run_output_new()]
+    readers = [threading.Thread(target=read, args=(process.stdout, stdout)),
+               threading.Thread(target=read, args=(process.stderr, stderr))]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+    rc, metrics = buildah_wait(process, start)
+    return rc, stdout, stderr, metrics
+
+
+def buildah_run_exec ( module, argv, capture ):
+
+    rc, stdout, stderr, metrics = buildah_run_stream(argv, capture)
+    return rc, stdout[0], stderr[0], metrics
+
+
+def buildah_run_batch ( module, buildah_basecmd, commands, stop_on_error, capture ):
+
+    results = []
+    for command in commands:
+        start = time.time()
+        rc, out, err, metrics = buildah_run_exec(module, buildah_basecmd + ['--'] + buildah_run_argv(command), capture)
+        result = dict(command=command, rc=rc, duration=round(time.time() - start, 3), metrics=metrics)
+        result.update(buildah_run_output_fields(out, 'stdout', capture))
+        result.update(buildah_run_output_fields(err, 'stderr', capture))
+        results.append(result)
+        if rc != 0 and stop_on_error:
+            break
+    return results
+
+
+def buildah_run_session_script ( commands, marker, stop_on_error ):
+
+    # every command runs in a subshell and is followed by a marker line with
+    # its rc on stdout and stderr, used to split the output again
+    script = ['failed=0']
+    for command in commands:
+        argv = buildah_run_argv(command)
+        if argv[:2] == ['/bin/sh', '-c'] and len(argv) == 3:
+            line = argv[2]
+        else:
+            line = ' '.join(quote(arg) for arg in argv)
+        script.append('(\n%s\n)' % line)
+        script.append('rc=$?')
+        if marker:
+            script.append("printf '\\n%%s %%d\\n' %s $rc" % marker)
+            script.append("printf '\\n%%s %%d\\n' %s $rc >&2" % marker)
+        if stop_on_error:
+            script.append('[ $rc -eq 0 ] || exit $rc')
+        else:
+            script.append('[ $rc -eq 0 ] || [ $failed -ne 0 ] || failed=$rc')
+    script.append('exit $failed')
+    return '\n'.join(script) + '\n'
+
+
+def buildah_run_session ( module, buildah_basecmd, commands, stop_on_error, capture ):
+
+    marker = '@@buildah-ansible-%s@@' % uuid.uuid4().hex
+    script = buildah_run_session_script(commands, marker, stop_on_error)
+
+    # the output is split while it is read
+    rc, stdout, stderr, metrics = buildah_run_stream(buildah_basecmd + ['--', '/bin/sh', '-c', script], capture, marker)
+
+    # the session only has a total duration and resource usage, per command
+    # they are unknown
+    results = []
+    for index, command in enumerate(commands):
+        if index >= len(stdout):
+            break
+        out = stdout[index]
+        err = stderr[index] if index < len(stderr) else buildah_run_output_new()
+        # no rc: the session stopped after a failure or died inside this command
+        if 'rc' not in out and (rc == 0 or (results and results[-1]['rc'] != 0)):
+            break
+        result = dict(command=command, rc=out.get('rc', rc), duration=None)
+        result.update(buildah_run_output_fields(out, 'stdout', capture))
+        result.update(buildah_run_output_fields(err, 'stderr', capture))
+        results.append(result)
+        if 'rc' not in out:
+            break
+    return results, metrics
+
+
+def buildah_run_commands ( module, buildah_basecmd, commands, stop_on_error, single_session, capture ):
+
+    start = time.time()
+    metrics = None
+    if single_session:
+        results, metrics = buildah_run_session(module, buildah_basecmd, commands, stop_on_error, capture)
+    else:
+        results = buildah_run_batch(module, buildah_basecmd, commands, stop_on_error, capture)
+
+    result = dict(rc=0, err='', results=results, duration=round(time.time() - start, 3))
+    if single_session:
+        result['metrics'] = metrics
+    failed = [index for index, command in enumerate(results) if command['rc'] != 0]
+    if failed:
+        first = results[failed[0]]
+        err = first.get('stderr') or 'exited with rc %d' % first['rc']
+        result.update(rc=first['rc'], err=first.get('stderr', ''),
+                      msg="%d of %d commands failed, first failure was command %d: %s" % (len(failed), len(commands), failed[0] + 1, err))
+    return result
+
+
+def buildah_run_bind_mounts ( module, mounts ):
+
+    # a mapping of src, target and options or a 'src:target' string
+    volumes = []
+    targets = []
+    for mount in mounts or []:
+        if isinstance(mount, dict):
+            src, target, options = mount.get('src'), mount.get('target'), mount.get('options')
+        else:
+            src, sep, target = str(mount).partition(':')
+            options = None
+        if not src or not target or not target.startswith('/'):
+            module.fail_json(msg="each mount needs a src and an absolute target")
+
+        src = os.path.abspath(os.path.expanduser(src))
+        if not os.path.exists(src):
+            module.fail_json(msg="mount source %s does not exist" % src)
+
+        volumes.append('%s:%s:%s' % (src, target, ','.join(['ro'] + ([options] if options else []))))
+        targets.append(target)
+
+    return volumes, targets
+
+
+def buildah_run_mountpoints ( module, buildah_bin, name, targets ):
+
+    # the runtime creates missing mountpoints in the rootfs, remember the
+    # topmost directory it will create for every target
+    rc, out, err = module.run_command([buildah_bin, 'mount', name])
+    if rc != 0:
+        return None
+    root = out.strip()
+
+    created = []
+    for target in targets:
+        path = '/'
+        for part in [p for p in target.split('/') if p]:
+            path = posixpath.join(path, part)
+            if not os.path.lexists(buildah_rootfs_path(root, path)):
+                created.append((path, target))
+                break
+
+    return root, created
+
+
+def buildah_run_mountpoints_remove ( module, buildah_bin, name, root, created ):
+
+    # only empty directories are removed, anything a command left in them stays
+    removed = []
+    try:
+        for top, target in created:
+            path = target
+            while True:
+                try:
+                    os.rmdir(buildah_rootfs_path(root, path))
+                except OSError:
+                    break
+                removed.append(path)
+                if path == top:
+                    break
+                path = posixpath.dirname(path)
+    finally:
+        module.run_command([buildah_bin, 'umount', name])
+
+    return removed
+
+
+def buildah_run_background ( module, buildah_basecmd, command, args, commands, stop_on_error, single_session, job_dir ):
+
+    # the job is described in job.json and run by a small detached runner
+    # which keeps status.json and output.log in the job directory up to date
+    if not commands:
+        steps = [dict(command=[command] + list(args or []), argv=buildah_basecmd + ['--', command] + list(args or []))]
+    elif single_session:
+        steps = [dict(command=commands, argv=buildah_basecmd + ['--', '/bin/sh', '-c', buildah_run_session_script(commands, None, stop_on_error)])]
+    else:
+        steps = [dict(command=command, argv=buildah_basecmd + ['--'] + buildah_run_argv(command)) for command in commands]
+
+    job_id = uuid.uuid4().hex
+    job = os.path.join(os.path.expanduser(job_dir), job_id)
+    os.makedirs(job)
+    with open(os.path.join(job, 'job.json'), 'w') as f:
+        json.dump(dict(commands=steps, stop_on_error=stop_on_error), f)
+    with open(os.path.join(job, 'status.json'), 'w') as f:
+        json.dump(dict(state='starting', pid=None, started=None, current=None, rc=None, results=[]), f)
+
+    # a new session keeps the runner alive when the connection goes away
+    devnull = open(os.devnull, 'r+b')
+    try:
+        subprocess.Popen([sys.executable, '-c', BUILDAH_RUN_JOB_RUNNER, job], stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True, cwd='/', preexec_fn=os.setsid)
+    finally:
+        devnull.close()
+
+    return dict(changed=True, job_id=job_id, job_dir=job, state='starting')
+
+
+def buildah_run_cache_diff ( root ):
+
+    # Digest of the container's uncommitted changes, read from the overlay
+    # upper directory next to the mounted rootfs: '' when there are none,
+    # None when the storage driver does not expose them.
+    diff = os.path.join(os.path.dirname(root), 'diff')
+    if os.path.basename(root) != 'merged' or not os.path.isdir(diff):
+        return None
+
+    digest = hashlib.sha256()
+    changes = 0
+    for top, dirs, files in os.walk(diff):
+        dirs.sort()
+        for entry in sorted(dirs + files):
+            path = os.path.join(top, entry)
+            st = os.lstat(path)
+            record = [os.path.relpath(path, diff), st.st_mode, st.st_uid, st.st_gid]
+            if stat.S_ISREG(st.st_mode):
+                record.append(buildah_file_digest(path))
+            elif stat.S_ISLNK(st.st_mode):
+                record.append(os.readlink(path))
+            elif stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+                # whiteouts are 0/0 character devices
+                record.append(st.st_rdev)
+            elif stat.S_ISDIR(st.st_mode):
+                try:
+                    record.append(bool(os.getxattr(path, 'trusted.overlay.opaque')))
+                except (AttributeError, OSError):
+                    record.append(False)
+            digest.update(json.dumps(record).encode('utf-8') + b'\n')
+            changes += 1
+
+    return digest.hexdigest() if changes else ''
+
+
+def buildah_run_cache_key ( info, diff, options, command, args, user, isolation, runtime, volume ):
+
+    config = (info.get('OCIv1') or {}).get('config') or {}
+
+    key = dict(parent=info.get('FromImageID', ''),
+               diff=diff,
+               options=options,
+               command=command,
+               args=args or [],
+               user=user or config.get('User', ''),
+               env=config.get('Env') or [],
+               workingdir=config.get('WorkingDir', ''),
+               isolation=isolation,
+               runtime=runtime,
+               volume=volume)
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def buildah_run_cache_rebase ( module, buildah_bin, container, container_id, options, image ):
+
+    # Replace the working container by a new one created from image with the
+    # options recorded for it, under the same name, so the next cached step is
+    # keyed on the image it really uses.  The image is a commit of the
+    # container, or was committed from the same parent, changes and command.
+    # The container ID changes.
+    rc, out, err = module.run_command([buildah_bin, 'from'] + options + [image])
+    if rc != 0:
+        return rc, out, err, None
+    new_container = out.strip().splitlines()[-1]
+
+    rc, out, err = module.run_command([buildah_bin, 'rm', container])
+    if rc != 0:
+        module.run_command([buildah_bin, 'rm', new_container])
+        return rc, out, err, None
+    buildah_container_options_remove(container_id)
+
+    rc, out, err = module.run_command([buildah_bin, 'rename', new_container, container])
+    if rc != 0:
+        return rc, out, err, None
+
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'container', '--format', '{{.ContainerID}}', container])
+    if rc == 0:
+        buildah_container_options_save(out.strip(), options)
+    return rc, out, err, out.strip()
+
+
+def buildah_run_cached ( module, name, command, args, isolation, runtime, user, volume, cache_repo, run ):
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'container', name])
+    if rc != 0:
+        module.fail_json(msg=err)
+    info = json.loads(out)
+    container = info.get('Container') or name
+
+    # the changes made since the container was created are part of the key
+    rc, out, err = module.run_command([buildah_bin, 'mount', container])
+    if rc != 0:
+        module.fail_json(msg=err)
+    try:
+        diff = buildah_run_cache_diff(out.strip())
+    finally:
+        module.run_command([buildah_bin, 'umount', container])
+
+    # a container recreated without the options it was made with would run
+    # the next steps in another environment
+    options = buildah_container_options_load(info.get('ContainerID'))
+
+    if diff is None or options is None:
+        # without a way to tell what the container holds, or to recreate it
+        # the same way, run uncached
+        result = run()
+        result.update(changed=True, cache_hit=False, cache_image=None)
+        if result['rc'] != 0:
+            module.fail_json(**result)
+        return result
+
+    key = buildah_run_cache_key(info, diff, options, command, args, user, isolation, runtime, volume)
+    cache_image = '%s:%s' % (cache_repo, key)
+
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'image', '--format', '{{.FromImageID}}', cache_image])
+    if rc == 0:
+        rc, out, err, container_id = buildah_run_cache_rebase(module, buildah_bin, container, info.get('ContainerID'), options, cache_image)
+        if rc != 0:
+            module.fail_json(msg=err, cache_image=cache_image)
+        return dict(changed=True, rc=rc, stdout='', err='', cache_hit=True, cache_image=cache_image,
+                    container=container, container_id=container_id)
+
+    result = run()
+    if result['rc'] != 0:
+        module.fail_json(cache_hit=False, **result)
+    result.update(changed=True, cache_hit=False, cache_image=cache_image)
+
+    rc, out, err = module.run_command([buildah_bin, 'commit', '--quiet', container, cache_image])
+    if rc == 0:
+        rc, out, err, container_id = buildah_run_cache_rebase(module, buildah_bin, container, info.get('ContainerID'), options, cache_image)
+    if rc != 0:
+        module.fail_json(msg="command succeeded but caching its result failed: %s" % err, **result)
+    result.update(container=container, container_id=container_id)
+
+    return result
 
 
 def main():
@@ -194,12 +841,27 @@ def main():
     module = AnsibleModule(
         argument_spec = dict(
             name=dict(required=True),
-            command=dict(required=True),
+            command=dict(required=False),
             args = dict(required=False, type='list'),
+            commands=dict(required=False, type='list'),
+            stop_on_error=dict(required=False, default="yes", type="bool"),
+            single_session=dict(required=False, default="no", type="bool"),
+            log_file=dict(required=False),
+            output_head=dict(required=False, type="int"),
+            output_tail=dict(required=False, type="int"),
+            output_summary=dict(required=False, default="no", type="bool"),
+            background=dict(required=False, default="no", type="bool"),
+            job_dir=dict(required=False, default="~/.cache/buildah-ansible/jobs"),
+            metrics_file=dict(required=False),
+            cache_mounts=dict(required=False, type='list'),
+            cache_dir=dict(required=False, default="~/.cache/buildah-ansible/mounts"),
+            mounts=dict(required=False, type='list'),
+            remove_mountpoints=dict(required=False, default="yes", type="bool"),
             cap_add=dict(required=False),
             cap_drop=dict(required=False),
             cni_config_dir=dict(required=False),
             cni_plugin_path=dict(required=False),
+            hostname=dict(required=False),
             ipc=dict(required=False),
             isolation=dict(required=False),
             net=dict(required=False),
@@ -210,8 +872,12 @@ def main():
             security_options=dict(required=False),
             user=dict(required=False),
             uts=dict(required=False),
-            volume=dict(required=False)
+            volume=dict(required=False),
+            cache=dict(required=False, default="no", type="bool"),
+            cache_repo=dict(required=False, default="localhost/buildah-run-cache")
         ),
+        required_one_of = [['command', 'commands']],
+        mutually_exclusive = [['command', 'commands']],
         supports_check_mode = True
     )
 
@@ -219,6 +885,20 @@ def main():
 
     command = params.get('command', '')
     args = params.get('args', '')
+    commands = params.get('commands', '')
+    stop_on_error = params.get('stop_on_error', '')
+    single_session = params.get('single_session', '')
+    log_file = params.get('log_file', '')
+    output_head = params.get('output_head', '')
+    output_tail = params.get('output_tail', '')
+    output_summary = params.get('output_summary', '')
+    background = params.get('background', '')
+    job_dir = params.get('job_dir', '')
+    metrics_file = params.get('metrics_file', '')
+    cache_mounts = params.get('cache_mounts', '')
+    cache_dir = params.get('cache_dir', '')
+    mounts = params.get('mounts', '')
+    remove_mountpoints = params.get('remove_mountpoints', '')
     name = params.get('name', '')
     cap_add = params.get('cap_add', '')
     cap_drop = params.get('cap_drop', '')
@@ -227,7 +907,7 @@ def main():
     hostname = params.get('hostname', '')
     ipc = params.get('ipc', '')
     isolation = params.get('isolation', '')
-    network = params.get('network', '')
+    network = params.get('net', '')
     pivot = params.get('pivot', '')
     pid = params.get('pid', '')
     runtime = params.get('runtime', '')
@@ -236,18 +916,96 @@ def main():
     user = params.get('user', '')
     uts = params.get('uts', '')
     volume = params.get('volume', '')
-
-    
-    rc, out, err =  buildah_run ( module, name, command, args, cap_add, cap_drop, cni_config_dir, cni_plugin_path, hostname, ipc, isolation, network, pivot, pid, runtime, runtime_flag, security_options, user, uts, volume )
-
-    if rc == 0:
-        module.exit_json(changed=True, rc=rc, stdout=out, err = err )
+    cache = params.get('cache', '')
+    cache_repo = params.get('cache_repo', '')
+
+    # cache mounts only speed the commands up, they are not part of the cache key
+    volumes, mounted = buildah_cache_mounts(module, cache_dir, cache_mounts)
+    extra = dict(cache_mounts=mounted) if cache_mounts else {}
+
+    # read-only bind mounts are inputs of the commands, their specs are
+    # part of the cache key, their content is not
+    bind_volumes, targets = buildah_run_bind_mounts(module, mounts)
+    key_volume = ([volume] if volume else []) + bind_volumes if bind_volumes else volume
+
+    buildah_basecmd = buildah_run_basecmd ( module, name, cap_add, cap_drop, cni_config_dir, cni_plugin_path, hostname, ipc, isolation, network, pivot, pid, runtime, runtime_flag, security_options, user, uts, ([volume] if volume else []) + bind_volumes + volumes )
+
+    if background:
+        # the runner only writes output.log and status.json in the job directory
+        unsupported = [option for option in ['cache', 'log_file', 'output_head', 'output_tail', 'output_summary', 'metrics_file']
+                       if params.get(option)]
+        if mounts and remove_mountpoints:
+            unsupported.append('mounts with remove_mountpoints')
+        if unsupported:
+            module.fail_json(msg="%s cannot be used with background" % ', '.join(unsupported))
+        if module.check_mode:
+            module.exit_json(**dict(extra, changed=True))
+        module.exit_json(**dict(extra, **buildah_run_background(module, buildah_basecmd, command, args, commands, stop_on_error, single_session, job_dir)))
+
+    capture = dict(log=None, lock=threading.Lock(), head=output_head, tail=output_tail, summary=output_summary)
+
+    def execute():
+        if commands:
+            result = buildah_run_commands(module, buildah_basecmd, commands, stop_on_error, single_session, capture)
+            records = result['results'] if not single_session else [dict(command=commands, rc=result['rc'], metrics=result['metrics'])]
+        else:
+            rc, out, err, metrics = buildah_run(module, buildah_basecmd, command, args, capture)
+            result = dict(rc=rc, metrics=metrics)
+            result.update(buildah_run_output_fields(out, 'stdout', capture))
+            result.update(buildah_run_output_fields(err, 'stderr', capture))
+            # err is where a single command always returned its stderr
+            if 'stderr' in result:
+                result['err'] = result['stderr']
+            if rc != 0:
+                result['msg'] = result.get('stderr') or 'exited with rc %d' % rc
+            records = [dict(command=[command] + list(args or []), rc=rc, metrics=metrics)]
+        if metrics_file:
+            buildah_metrics_save(metrics_file, [dict(record.get('metrics') or {}, container=name, command=record['command'], rc=record['rc'])
+                                                for record in records])
+        return result
+
+    def run():
+        # mountpoints are removed before the cache commits the container
+        mountpoints = None
+        if targets and remove_mountpoints:
+            mountpoints = buildah_run_mountpoints(module, buildah_basecmd[0], name, targets)
+        removed = []
+        try:
+            result = execute()
+        finally:
+            if mountpoints:
+                removed = buildah_run_mountpoints_remove(module, buildah_basecmd[0], name, *mountpoints)
+        if targets:
+            result['removed_mountpoints'] = removed
+        return result
+
+    try:
+        if log_file:
+            log_file = os.path.expanduser(log_file)
+            if os.path.dirname(log_file) and not os.path.isdir(os.path.dirname(log_file)):
+                os.makedirs(os.path.dirname(log_file))
+            capture['log'] = open(log_file, 'wb')
+
+        if cache:
+            # the whole command list is one cached step
+            extra.update(log_file=log_file)
+            module.exit_json(**dict(extra, **buildah_run_cached(module, name, commands or command, None if commands else args, isolation, runtime, user, key_volume, cache_repo, run)))
+
+        result = run()
+    finally:
+        if capture['log']:
+            capture['log'].close()
+
+    result.update(extra, log_file=log_file)
+    if result['rc'] == 0:
+        module.exit_json(changed=True, **result)
     else:
-        module.fail_json(msg = err )
+        module.fail_json(changed=bool(commands), **result)
 
 # import module snippets
 from ansible.module_utils.basic import *
 from ansible.module_utils.urls import *
+from ansible.module_utils.buildah_common import *
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+
+#!/usr/bin/python -tt
+# -*- coding: utf-8 -*-
+# (c) 2019, Red Hat, Inc
+# Written by Lester Claudio <claudiol at redhat.com>
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import errno
+import json
+import shutil
+import time
+
+
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'community',
+                    'version': '1.0'}
+
+DOCUMENTATION = '''
+---
+module: buildah_run_status
+version_added: historical
+short_description: Reports the state and the output of a buildah_run started with background.
+description:
+     - Reads the job directory written by a background buildah_run and reports its state
+       (starting, running, finished, failed or lost), the rc and duration of every finished
+       command and the output written since C(offset).  It never calls buildah and is cheap
+       to poll.
+options:
+  job_id:
+    description:
+      - The job_id returned by buildah_run.
+    required: true
+  job_dir:
+    description:
+      - Directory holding the jobs, the same as given to buildah_run.
+    required: false
+    default: ~/.cache/buildah-ansible/jobs
+  offset:
+    description:
+      - Byte offset in the job output to return output from, use the C(offset) of the
+        previous poll to only get new output.
+    required: false
+    default: 0
+  max_bytes:
+    description:
+      - Maximum number of output bytes returned by one poll.
+    required: false
+    default: 65536
+  remove:
+    description:
+      - Remove the job directory once the job is no longer running.
+    required: false
+    default: no
+
+# informational: requirements for nodes
+requirements: [ buildah ]
+author:
+    - "Red Hat Consulting (NAPS)"
+    - "Lester Claudio"
+'''
+
+EXAMPLES = '''
+  - name: BUILDAH | Start a long compile step in the background
+    buildah_run:
+      name: fedora-working-container
+      command: make
+      args: ['-C', '/src', '-j8']
+      background: yes
+    register: job
+
+  - name: BUILDAH | Poll the background step until it is done
+    buildah_run_status:
+      job_id: "{{ job.job_id }}"
+      remove: yes
+    register: status
+    until: status.state not in ['starting', 'running']
+    retries: 360
+    delay: 10
+
+  - debug: var=status.results
+
+'''
+
+# seconds a runner gets to record its pid before its job counts as lost
+BUILDAH_RUN_STATUS_START_GRACE = 30
+
+
+def buildah_run_status_alive ( pid ):
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def buildah_run_status ( module, job, offset, max_bytes ):
+
+    try:
+        with open(os.path.join(job, 'status.json')) as f:
+            status = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        module.fail_json(msg="cannot read the status of job %s: %s" % (job, e))
+
+    # a runner that went away without writing its final state, or that died
+    # before it could write its first one
+    if status['state'] == 'running' and not buildah_run_status_alive(status['pid']):
+        status['state'] = 'lost'
+    elif status['state'] == 'starting' and status.get('pid') is None:
+        try:
+            age = time.time() - os.path.getmtime(os.path.join(job, 'status.json'))
+        except OSError:
+            age = 0
+        if age > BUILDAH_RUN_STATUS_START_GRACE:
+            status['state'] = 'lost'
+
+    output = b''
+    size = 0
+    try:
+        with open(os.path.join(job, 'output.log'), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(min(offset, size))
+            output = f.read(max_bytes)
+    except (IOError, OSError):
+        pass
+
+    status.update(output=output.decode('utf-8', 'replace'), offset=min(offset, size) + len(output), size=size)
+    return status
+
+
+def main():
+
+    module = AnsibleModule(
+        argument_spec = dict(
+            job_id=dict(required=True),
+            job_dir=dict(required=False, default="~/.cache/buildah-ansible/jobs"),
+            offset=dict(required=False, default=0, type="int"),
+            max_bytes=dict(required=False, default=65536, type="int"),
+            remove=dict(required=False, default="no", type="bool")
+        ),
+        supports_check_mode = True
+    )
+
+    params = module.params
+
+    job_id = params.get('job_id', '')
+    job_dir = params.get('job_dir', '')
+    offset = params.get('offset', '')
+    max_bytes = params.get('max_bytes', '')
+    remove = params.get('remove', '')
+
+    job = os.path.join(os.path.expanduser(job_dir), os.path.basename(job_id))
+    status = buildah_run_status(module, job, offset, max_bytes)
+
+    changed = False
+    if remove and status['state'] not in ['starting', 'running'] and not module.check_mode:
+        shutil.rmtree(job, ignore_errors=True)
+        changed = True
+
+    module.exit_json(changed=changed, job_id=job_id, **status)
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.urls import *
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+# (c) 2019, Red Hat, Inc
+# Written by Lester Claudio <claudiol at redhat.com>
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Helpers shared by the buildah modules and the buildah_copy action plugin,
+# imported as ansible.module_utils.buildah_common.
+
+import os
+import errno
+import hashlib
+import json
+import posixpath
+import re
+import stat
+import tempfile
+import time
+
+BUILDAH_CONTAINER_OPTIONS_DIR = '~/.cache/buildah-ansible/containers'
+
+
+def buildah_exclude_patterns ( src, exclude, ignore_file ):
+
+    # the .containerignore (or .dockerignore) of a source directory comes
+    # first, exclude is appended so that its patterns win
+    lines = []
+    if ignore_file and os.path.isdir(src):
+        for filename in ['.containerignore', '.dockerignore']:
+            path = os.path.join(src, filename)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    lines.extend(f.read().splitlines())
+                break
+    lines.extend(exclude or [])
+
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        pattern = posixpath.normpath(line[1:].strip() if negate else line).lstrip('/')
+        if pattern not in ['', '.']:
+            patterns.append('!' + pattern if negate else pattern)
+    return patterns
+
+
+def buildah_exclude_compile ( patterns ):
+
+    # * and ? stay within one path element, ** spans any number of them
+    compiled = []
+    for pattern in patterns:
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if pattern.startswith('**/', i):
+                regex += '(?:.*/)?'
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                regex += '.*'
+                i += 2
+                continue
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[' and pattern.find(']', i + 1) > i + 1:
+                end = pattern.find(']', i + 1)
+                chars = pattern[i + 1:end]
+                if chars[0] in '!^':
+                    chars = '^' + chars[1:]
+                regex += '[' + chars.replace('\\', '\\\\') + ']'
+                i = end
+            elif c == '\\' and i + 1 < len(pattern):
+                regex += re.escape(pattern[i + 1])
+                i += 1
+            else:
+                regex += re.escape(c)
+            i += 1
+        compiled.append((negate, re.compile('^' + regex + '$')))
+    return compiled
+
+
+def buildah_excluded ( relpath, excludes ):
+
+    # the last matching pattern wins, a pattern matching a directory matches
+    # everything below it
+    parts = relpath.split('/')
+    prefixes = ['/'.join(parts[:n]) for n in range(1, len(parts) + 1)]
+    excluded = False
+    for negate, regex in excludes:
+        if negate != excluded:
+            continue
+        if any(regex.match(prefix) for prefix in prefixes):
+            excluded = not negate
+    return excluded
+
+
+def buildah_exclude_file ( patterns ):
+
+    # the combined patterns for buildah's --ignorefile
+    fd, path = tempfile.mkstemp(prefix='buildah-ignore')
+    with os.fdopen(fd, 'w') as f:
+        f.write('\n'.join(patterns) + '\n')
+    return path
+
+
+def buildah_copy_mode ( mode ):
+
+    # an octal string, or an int as YAML already turned 0644 into one
+    if mode is None or mode == '':
+        return None
+    if isinstance(mode, int):
+        return mode
+    return int(str(mode), 8)
+
+
+def buildah_source_entries ( src, excludes=None ):
+
+    # (relative path, host path) for src and everything below it.  Excluded
+    # directories are not even walked, unless a '!' pattern could bring back
+    # something below them.
+    yield '', src
+    if os.path.isdir(src) and not os.path.islink(src):
+        prune = excludes and not any(negate for negate, regex in excludes)
+        for root, dirs, files in os.walk(src):
+            dirs.sort()
+            for entry in sorted(dirs + files):
+                path = os.path.join(root, entry)
+                relpath = os.path.relpath(path, src)
+                if excludes and buildah_excluded(relpath, excludes):
+                    if prune and entry in dirs:
+                        dirs.remove(entry)
+                    continue
+                yield relpath, path
+
+
+def buildah_rootfs_path ( root, path, follow=True ):
+
+    # Resolve path inside the container rootfs mounted at root, following
+    # symlinks the way the container would see them so that an absolute or
+    # '..' link can never lead outside of root.
+    parts = [p for p in path.split('/') if p not in ['', '.']]
+    resolved = root
+    links = 0
+
+    while parts:
+        part = parts.pop(0)
+        if part == '..':
+            if resolved != root:
+                resolved = os.path.dirname(resolved)
+            continue
+
+        candidate = os.path.join(resolved, part)
+        if os.path.islink(candidate) and (follow or parts):
+            links += 1
+            if links > 40:
+                raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+            target = os.readlink(candidate)
+            if target.startswith('/'):
+                resolved = root
+            parts = [p for p in target.split('/') if p not in ['', '.']] + parts
+            continue
+
+        resolved = candidate
+
+    return resolved
+
+
+def buildah_file_digest ( path ):
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def buildah_hash_index_load ( path ):
+
+    index = dict(path=os.path.expanduser(path) if path else None, entries={}, dirty=False)
+    if index['path']:
+        try:
+            with open(index['path']) as f:
+                index['entries'] = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+    return index
+
+
+def buildah_hash_index_digest ( index, path ):
+
+    # Reuse the stored digest while size, mtime, ctime, inode and device are
+    # unchanged; used for source files and for their copies in a mounted
+    # rootfs alike.  Files modified in the last seconds are not stored, their
+    # mtime could still change without the timestamp moving.
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    signature = [st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), getattr(st, 'st_ctime_ns', st.st_ctime),
+                 st.st_ino, st.st_dev]
+    now = time.time()
+
+    entry = index['entries'].get(key)
+    if entry and entry[:5] == signature:
+        if now - entry[6] > 3600:
+            entry[6] = now
+            index['dirty'] = True
+        return entry[5]
+
+    digest = buildah_file_digest(path)
+    if index['path'] and now - max(st.st_mtime, st.st_ctime) > 2:
+        index['entries'][key] = signature + [digest, now]
+        index['dirty'] = True
+    return digest
+
+
+def buildah_hash_index_save ( index, roots, size ):
+
+    if not index['path']:
+        return
+
+    # forget files that are gone from the source trees
+    roots = set(os.path.abspath(root) for root in (roots if isinstance(roots, list) else [roots]))
+    for key in list(index['entries'].keys()):
+        parent = key
+        while parent not in roots and os.path.dirname(parent) != parent:
+            parent = os.path.dirname(parent)
+        if parent in roots and not os.path.lexists(key):
+            del index['entries'][key]
+            index['dirty'] = True
+
+    if not index['dirty']:
+        return
+
+    # keep the most recently used entries
+    if len(index['entries']) > size:
+        keep = sorted(index['entries'].items(), key=lambda item: item[1][-1], reverse=True)[:size]
+        index['entries'] = dict(keep)
+
+    dirname = os.path.dirname(index['path'])
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.hash-index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index['entries'], f)
+        os.rename(tmp, index['path'])
+    except (IOError, OSError):
+        pass
+
+
+def buildah_rootfs_db ( root, dbfile ):
+
+    entries = {}
+    with open(buildah_rootfs_path(root, '/etc/' + dbfile)) as f:
+        for line in f:
+            fields = line.strip().split(':')
+            if len(fields) > 3:
+                entries[fields[0]] = fields
+    return entries
+
+
+def buildah_chown_ids ( root, chown ):
+
+    # Map a --chown value to (uid, gid) using the container's own passwd and
+    # group files; buildah defaults to root when no --chown is given.  None
+    # means the owner cannot be worked out and the copy has to run.
+    if not chown:
+        return 0, 0
+
+    user, _, group = chown.partition(':')
+    if user.isdigit() and group.isdigit():
+        return int(user), int(group)
+
+    uid = gid = None
+    if user.isdigit():
+        uid = int(user)
+    else:
+        passwd = buildah_rootfs_db(root, 'passwd')
+        if user not in passwd:
+            return None
+        uid, gid = int(passwd[user][2]), int(passwd[user][3])
+
+    if group.isdigit():
+        gid = int(group)
+    elif group:
+        groups = buildah_rootfs_db(root, 'group')
+        if group not in groups:
+            return None
+        gid = int(groups[group][2])
+
+    if gid is None:
+        return None
+    return uid, gid
+
+
+def buildah_id_maps ( module, buildah_bin, name ):
+
+    # The container's uid and gid maps as [container_id, host_id, size]
+    # ranges, empty when it uses the host's IDs; None when unknown.
+    rc, out, err = module.run_command([buildah_bin, 'inspect', '--type', 'container', name])
+    if rc != 0:
+        return None
+    try:
+        options = json.loads(out).get('IDMappingOptions') or {}
+    except ValueError:
+        return None
+
+    maps = []
+    for key in ['UIDMap', 'GIDMap']:
+        maps.append([[item['container_id'], item['host_id'], item['size']] for item in options.get(key) or []])
+    return maps
+
+
+def buildah_host_ids ( owner, id_maps ):
+
+    # (uid, gid) inside the container to what the mounted rootfs holds on the
+    # host; None when the maps are unknown or do not cover one of them
+    if owner is None or id_maps is None:
+        return None
+
+    ids = []
+    for value, ranges in zip(owner, id_maps):
+        if ranges:
+            hits = [host_id + value - container_id for container_id, host_id, size in ranges
+                    if container_id <= value < container_id + size]
+            if not hits:
+                return None
+            value = hits[0]
+        ids.append(value)
+    return tuple(ids)
+
+
+def buildah_entry_matches ( src_path, dest_path, owner, index, mode=None ):
+
+    src_st = os.lstat(src_path)
+    try:
+        dest_st = os.lstat(dest_path)
+    except OSError:
+        return False
+
+    if stat.S_IFMT(src_st.st_mode) != stat.S_IFMT(dest_st.st_mode):
+        return False
+    if (dest_st.st_uid, dest_st.st_gid) != owner:
+        return False
+    if stat.S_ISLNK(src_st.st_mode):
+        return os.readlink(src_path) == os.readlink(dest_path)
+    if (mode if mode is not None else stat.S_IMODE(src_st.st_mode)) != stat.S_IMODE(dest_st.st_mode):
+        return False
+    if stat.S_ISREG(src_st.st_mode):
+        if src_st.st_size != dest_st.st_size:
+            return False
+        return buildah_hash_index_digest(index, src_path) == buildah_hash_index_digest(index, dest_path)
+    return True
+
+
+def buildah_copy_layout ( root, src, dest, excludes=None ):
+
+    # directory contents land in dest, a file lands in dest or below it when
+    # dest is a directory, like "buildah copy" does
+    if os.path.isdir(src) and not os.path.islink(src):
+        entries = buildah_source_entries(src, excludes)
+        next(entries)
+        return dest, entries
+
+    if dest.endswith('/') or os.path.isdir(buildah_rootfs_path(root, dest)):
+        dest = posixpath.join(dest, os.path.basename(src))
+    return dest, [('', src)]
+
+
+def buildah_content_matches ( root, id_maps, src, dest, chown, index, mode=None, excludes=None ):
+
+    # relative destinations depend on the container's working directory
+    if not dest.startswith('/'):
+        return False
+
+    owner = buildah_host_ids(buildah_chown_ids(root, chown), id_maps)
+    if owner is None:
+        return False
+
+    if os.path.isdir(src) and not os.path.islink(src) and not os.path.isdir(buildah_rootfs_path(root, dest)):
+        return False
+
+    dest, entries = buildah_copy_layout(root, src, dest, excludes)
+    for relpath, src_path in entries:
+        path = posixpath.join(dest, relpath) if relpath else dest
+        dest_path = os.path.join(buildah_rootfs_path(root, posixpath.dirname(path)), posixpath.basename(path))
+        if not buildah_entry_matches(src_path, dest_path, owner, index, mode):
+            return False
+
+    return True
+
+
+def buildah_content_uptodate ( module, name, src, dest, chown, hash_index, hash_index_size, mode=None, excludes=None ):
+
+    if not os.path.exists(src):
+        return False
+
+    buildah_bin = module.get_bin_path('buildah', required=True)
+    rc, out, err = module.run_command([buildah_bin, 'mount', name])
+    if rc != 0:
+        return False
+
+    index = buildah_hash_index_load(hash_index)
+    try:
+        id_maps = buildah_id_maps(module, buildah_bin, name)
+        return buildah_content_matches(out.strip(), id_maps, src, dest, chown, index, mode, excludes)
+    except (IOError, OSError, ValueError):
+        return False
+    finally:
+        module.run_command([buildah_bin, 'umount', name])
+        buildah_hash_index_save(index, src, hash_index_size)
+
+
+def buildah_cache_size ( value ):
+
+    # bytes, or a number with a k, m, g or t suffix; YAML booleans are ints to
+    # python but never a size
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("invalid size '%s'" % value)
+    if isinstance(value, int):
+        return value
+    match = re.match('^\\s*(\\d+(?:\\.\\d+)?)\\s*([kmgt]?)i?b?\\s*$', str(value), re.I)
+    if not match:
+        raise ValueError("invalid size '%s'" % value)
+    return int(float(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2).lower() or ' '))
+
+
+def buildah_cache_prune ( path, size_limit ):
+
+    # drop the least recently used files until the cache fits in size_limit
+    files = []
+    size = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            filename = os.path.join(root, name)
+            try:
+                st = os.lstat(filename)
+            except OSError:
+                continue
+            size += st.st_size
+            files.append((max(st.st_atime, st.st_mtime), st.st_size, filename))
+
+    pruned = 0
+    if size > size_limit:
+        for used, file_size, filename in sorted(files):
+            if size - pruned <= size_limit:
+                break
+            try:
+                os.remove(filename)
+                pruned += file_size
+            except OSError:
+                pass
+        for root, dirs, names in os.walk(path, topdown=False):
+            # a concurrent run may have refilled or removed it meanwhile
+            try:
+                if root != path and not os.listdir(root):
+                    os.rmdir(root)
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                    raise
+
+    return size - pruned, pruned
+
+
+def buildah_cache_mounts ( module, cache_dir, cache_mounts ):
+
+    volumes = []
+    mounted = {}
+    for mount in cache_mounts or []:
+        if not isinstance(mount, dict) or not mount.get('name') or not mount.get('target'):
+            module.fail_json(msg="each cache mount needs a name and a target")
+        if not re.match('^[A-Za-z0-9][A-Za-z0-9_.-]*$', mount['name']):
+            module.fail_json(msg="invalid cache mount name '%s'" % mount['name'])
+        try:
+            size_limit = buildah_cache_size(mount.get('size_limit'))
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+
+        path = os.path.join(os.path.expanduser(cache_dir), mount['name'])
+        if not os.path.isdir(path) and not module.check_mode:
+            os.makedirs(path)
+
+        # pruned before it is mounted, the files of the last use count as the newest
+        size, pruned = None, 0
+        if size_limit is not None and not module.check_mode:
+            size, pruned = buildah_cache_prune(path, size_limit)
+
+        volume = '%s:%s' % (path, mount['target'])
+        if mount.get('options'):
+            volume += ':' + mount['options']
+        volumes.append(volume)
+        mounted[mount['name']] = dict(path=path, target=mount['target'], bytes=size, pruned_bytes=pruned)
+
+    return volumes, mounted
+
+
+def buildah_container_options_path ( container_id ):
+
+    return os.path.join(os.path.expanduser(BUILDAH_CONTAINER_OPTIONS_DIR), '%s.json' % container_id)
+
+
+def buildah_container_options_save ( container_id, options ):
+
+    # The "buildah from" options a container was created with.  Inspect does
+    # not report all of them (volumes for one), buildah_run needs them to
+    # recreate the container from a cached image.
+    path = buildah_container_options_path(container_id)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.options')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(options, f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def buildah_container_options_load ( container_id ):
+
+    # None when the container was not created by buildah_from or buildah_run
+    try:
+        with open(buildah_container_options_path(container_id)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def buildah_container_options_remove ( container_id ):
+
+    try:
+        os.remove(buildah_container_options_path(container_id))
+    except OSError:
+        pass
+
+
+def buildah_wait ( process, start ):
+
+    # wait4 also returns the resources used by the process and the children
+    # it waited for, a buildah run step includes the container processes
+    pid, status, usage = os.wait4(process.pid, 0)
+    rc = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    process.returncode = rc
+
+    return rc, dict(wall_time=round(time.time() - start, 3),
+                    user_time=round(usage.ru_utime, 3),
+                    system_time=round(usage.ru_stime, 3),
+                    max_rss=usage.ru_maxrss * 1024,
+                    read_bytes=usage.ru_inblock * 512,
+                    write_bytes=usage.ru_oublock * 512)
+
+
+def buildah_metrics_save ( path, records ):
+
+    # one JSON document per line, appended so the file can collect many runs
+    path = os.path.expanduser(path)
+    if os.path.dirname(path) and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(dict(record, time=round(time.time(), 3)), sort_keys=True) + '\n')